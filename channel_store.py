@@ -0,0 +1,517 @@
+import heapq
+import json
+import os
+import re
+import sys
+from array import array
+from itertools import compress
+from m3u_parser import normalize_field, normalize_lines, normalize_text
+
+# Cabecera de los archivos creados con ChannelStore.save
+SNAPSHOT_MAGIC = b'KIDNEYSM3U-STORE 1\n'
+
+# Resultados como máximo de la búsqueda aproximada, ordenados por parecido
+FUZZY_LIMIT = 500
+
+# Términos de búsqueda: palabra, "frase entre comillas" o campo:valor
+_SEARCH_TERM_RE = re.compile(r'(?:([\w-]+):(?=\S))?(?:"([^"]*)"?|(\S+))')
+
+
+def parse_search(query):
+    """
+    Convierte el texto del buscador en una tupla de términos (campo, texto)
+    que deben cumplirse todos. campo es 'name', 'group' o 'url':
+
+    - antena 3          nombre con "antena" y con "3"
+    - "la 1"            nombre con "la 1" seguidos
+    - group:deportes    grupo (group-title) con "deportes"; también grupo:
+    - url:m3u8          URL con "m3u8"
+
+    Nombre y grupo se comparan normalizados (sin mayúsculas, acentos ni
+    signos de puntuación, ver m3u_parser.normalize_text) y la URL en
+    minúsculas. Un prefijo que no es un campo conocido ("ES:") se busca
+    como parte del nombre.
+    """
+    terms = []
+    for match in _SEARCH_TERM_RE.finditer(query):
+        field, phrase, word = match.groups()
+        value = phrase if phrase is not None else word
+        kind = 'name'
+        if field is not None:
+            field = field.lower()
+            if field == 'url':
+                kind = 'url'
+            elif normalize_field(field) == 'group-title':
+                kind = 'group'
+            elif normalize_field(field) != 'name':
+                value = match.group(0)
+        value = value.lower().strip() if kind == 'url' else normalize_text(value)
+        if value:
+            terms.append((kind, value))
+    return tuple(terms)
+
+
+def _one_edit_pattern(needle):
+    """
+    Expresión que encuentra needle con un error: una letra cambiada, una de
+    más o de menos, o dos letras seguidas intercambiadas.
+    """
+    alternatives = set()
+    for i in range(len(needle)):
+        head, tail = re.escape(needle[:i]), needle[i + 1:]
+        alternatives.add(head + '.' + re.escape(tail))
+        alternatives.add(head + re.escape(tail))
+        alternatives.add(head + '.' + re.escape(needle[i:]))
+        if tail:
+            alternatives.add(head + re.escape(tail[0] + needle[i] + tail[1:]))
+    return re.compile('|'.join(sorted(alternatives, key=len, reverse=True)))
+
+
+def _narrows(previous, terms):
+    """
+    Indica si toda coincidencia de terms lo es también de previous (cada
+    término anterior está contenido en uno nuevo del mismo campo), de modo
+    que basta con buscar entre los resultados anteriores.
+    """
+    return all(any(kind == new_kind and value in new_value for new_kind, new_value in terms)
+               for kind, value in previous)
+
+
+class ChannelStore:
+    """
+    Almacén compacto de canales en columnas. Los nombres y las URL se
+    guardan como UTF-8 en un único bytearray por columna (cada valor
+    seguido de un salto de línea), con un array de posiciones de fin, y los
+    grupos como un índice a una tabla de nombres de grupo sin repetir. Con
+    listas grandes ocupa varias veces menos que una lista de tuplas
+    (nombre, url), y las vistas filtradas (ChannelView) son arrays de
+    índices en lugar de copias.
+
+    Los canales eliminados se marcan y dejan de aparecer en las vistas; sus
+    índices no se reutilizan hasta clear().
+    """
+
+    def __init__(self, channels=()):
+        self.clear()
+        self.extend(channels)
+
+    def clear(self):
+        self._names = bytearray()
+        self._name_ends = array('q')
+        self._urls = bytearray()
+        self._url_ends = array('q')
+        self._groups = array('I')
+        self._group_names = ['']
+        self._group_ids = {'': 0}
+        # Índice por grupo: filas de cada grupo (por id) y canales que le
+        # quedan sin eliminar
+        self._group_rows = [array('I')]
+        self._group_counts = array('I', [0])
+        self._deleted = bytearray()
+        # Índices de los canales no eliminados, en orden creciente
+        self.order = array('I')
+        # Índice de búsqueda: nombre normalizado de cada canal, nombres de
+        # grupo normalizados y URL en minúsculas (esta se crea al buscar)
+        self._folded = []
+        self._folded_groups = []
+        self._url_lines = None
+        # Claves de la búsqueda aproximada: nombres normalizados sin espacios
+        self._compact = []
+        self._last_fuzzy = None
+        # Se incrementa con cada cambio para invalidar la última búsqueda
+        self._generation = 0
+        self._last_search = None
+
+    def append(self, name, url, group=''):
+        """Añade un canal y devuelve su índice"""
+        index = len(self._name_ends)
+        # Los saltos de línea separan los valores; un nombre no puede tenerlos
+        self._names += name.replace('\n', ' ').encode('utf-8') + b'\n'
+        self._name_ends.append(len(self._names))
+        self._urls += url.encode('utf-8') + b'\n'
+        self._url_ends.append(len(self._urls))
+        group_id = self._group_ids.get(group)
+        if group_id is None:
+            group_id = self._group_ids[group] = len(self._group_names)
+            self._group_names.append(group)
+            self._group_rows.append(array('I'))
+            self._group_counts.append(0)
+        self._groups.append(group_id)
+        self._group_rows[group_id].append(index)
+        self._group_counts[group_id] += 1
+        self._deleted.append(0)
+        self.order.append(index)
+        self._url_lines = None
+        self._generation += 1
+        return index
+
+    def extend(self, channels, folded=None):
+        """
+        Añade pares (nombre, url) o tríos (nombre, url, grupo). folded puede
+        traer los nombres ya normalizados con m3u_parser.normalize_lines
+        (uno por línea, por ejemplo calculados en el hilo de carga) para no
+        tener que hacerlo al buscar.
+        """
+        rows = len(self._name_ends)
+        for channel in channels:
+            self.append(*channel)
+        added = len(self._name_ends) - rows
+        if folded is not None and added and len(self._folded) == rows:
+            folded = folded.split('\n')
+            if len(folded) == added:
+                self._folded.extend(folded)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        for index in self.order:
+            yield self[index]
+
+    def __getitem__(self, index):
+        """Devuelve el par (nombre, url) del canal con ese índice del almacén"""
+        return self.name(index), self.url(index)
+
+    def __contains__(self, channel):
+        name, url = channel
+        target = url.encode('utf-8') + b'\n'
+        urls, ends = self._urls, self._url_ends
+        for index in self.order:
+            start = ends[index - 1] if index else 0
+            if urls[start:ends[index]] == target and self.name(index) == name:
+                return True
+        return False
+
+    def name(self, index):
+        start = self._name_ends[index - 1] if index else 0
+        return self._names[start:self._name_ends[index] - 1].decode('utf-8')
+
+    def url(self, index):
+        start = self._url_ends[index - 1] if index else 0
+        return self._urls[start:self._url_ends[index] - 1].decode('utf-8')
+
+    def group(self, index):
+        return self._group_names[self._groups[index]]
+
+    def remove(self, index):
+        """Elimina el canal con ese índice del almacén"""
+        self.order.remove(index)
+        self._deleted[index] = 1
+        self._group_counts[self._groups[index]] -= 1
+        self._generation += 1
+
+    def has_removed(self):
+        """Indica si se ha eliminado algún canal desde el último clear()"""
+        return self._deleted.find(1) >= 0
+
+    def save(self, path, meta=None):
+        """
+        Guarda el almacén en path tal como está en memoria (las columnas y
+        los arrays de posiciones en bruto), con meta como datos adicionales
+        en la cabecera. Los canales eliminados no se guardan aparte: solo se
+        admite un almacén sin eliminados.
+        """
+        if self.has_removed():
+            raise ValueError("No se puede guardar un almacén con canales eliminados")
+        header = {
+            'meta': meta or {},
+            'byteorder': sys.byteorder,
+            'rows': len(self._name_ends),
+            'names': len(self._names),
+            'urls': len(self._urls),
+            'groups': self._group_names,
+        }
+        # El índice de búsqueda se guarda si está completo
+        folded = None
+        if self._name_ends and len(self._folded) == len(self._name_ends):
+            folded = '\n'.join(self._folded).encode('utf-8')
+            header['folded'] = len(folded)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            for column in (self._names, self._urls, self._name_ends, self._url_ends, self._groups):
+                f.write(column)
+            if folded is not None:
+                f.write(folded)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Carga un almacén guardado con save() con una sola lectura del
+        archivo. Devuelve (almacén, meta); si el archivo no es válido lanza
+        ValueError.
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(SNAPSHOT_MAGIC):
+            raise ValueError("No es un archivo de canales guardado")
+        start = len(SNAPSHOT_MAGIC)
+        end = data.index(b'\n', start)
+        header = json.loads(data[start:end].decode('utf-8'))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError("Archivo de canales guardado en otra arquitectura")
+        rows = header['rows']
+        store = cls()
+        view = memoryview(data)
+        pos = end + 1
+        for attr, length in (('_names', header['names']), ('_urls', header['urls'])):
+            setattr(store, attr, bytearray(view[pos:pos + length]))
+            pos += length
+        for column in (store._name_ends, store._url_ends, store._groups):
+            length = rows * column.itemsize
+            column.frombytes(view[pos:pos + length])
+            pos += length
+        if 'folded' in header:
+            length = header['folded']
+            store._folded = str(view[pos:pos + length], 'utf-8').split('\n')
+            pos += length
+        if pos != len(data):
+            raise ValueError("Archivo de canales incompleto")
+        store._group_names = header['groups']
+        store._group_ids = {name: i for i, name in enumerate(store._group_names)}
+        store._group_rows = [array('I') for _ in store._group_names]
+        for index, group_id in enumerate(store._groups):
+            store._group_rows[group_id].append(index)
+        store._group_counts = array('I', map(len, store._group_rows))
+        store._deleted = bytearray(rows)
+        store.order = array('I', range(rows))
+        return store, header['meta']
+
+    def view(self, indices=None):
+        """Vista de todos los canales o de los índices indicados"""
+        return ChannelView(self, indices)
+
+    def groups(self):
+        """
+        Pares (grupo, número de canales) de los grupos con algún canal, en el
+        orden en que aparecen en la lista. El grupo vacío son los canales sin
+        group-title.
+        """
+        return [(name, count) for name, count in zip(self._group_names, self._group_counts) if count]
+
+    def group_view(self, group):
+        """
+        Vista con los canales de un grupo. Las filas de cada grupo se guardan
+        al añadir los canales, así que no se recorre el almacén: solo se
+        copian las de ese grupo.
+        """
+        group_id = self._group_ids.get(group)
+        if group_id is None:
+            return ChannelView(self, array('I'))
+        rows = self._group_rows[group_id]
+        if self._group_counts[group_id] != len(rows):
+            deleted = self._deleted
+            return ChannelView(self, array('I', [i for i in rows if not deleted[i]]))
+        return ChannelView(self, array('I', rows))
+
+    def folded_names(self):
+        """
+        Nombres normalizados (m3u_parser.normalize_text) de todos los canales,
+        en el orden del almacén. Los que aún no lo están se normalizan de una
+        vez al pedirlo.
+        """
+        rows, done = len(self._name_ends), len(self._folded)
+        if done < rows:
+            start = self._name_ends[done - 1] if done else 0
+            self._folded.extend(normalize_lines(self._names[start:-1].decode('utf-8')).split('\n'))
+        return self._folded
+
+    def _column(self, kind):
+        """Textos por fila con los que se compara un término de ese campo"""
+        if kind == 'name':
+            return self.folded_names()
+        if self._url_lines is None:
+            self._url_lines = self._urls[:-1].decode('utf-8').lower().split('\n') if self._urls else []
+        return self._url_lines
+
+    def search(self, query):
+        """
+        Vista con los canales que cumplen query (ver parse_search). Cada
+        término es una pasada sobre una lista precalculada (nombres
+        normalizados, grupos o URL en minúsculas) que deja solo las filas que
+        lo cumplen, de modo que los siguientes términos recorren menos filas.
+        Si la consulta solo añade texto a la anterior (se sigue escribiendo),
+        se parte de los resultados anteriores en lugar de todo el almacén.
+        """
+        terms = parse_search(query)
+        if not terms:
+            return self.view()
+        last = self._last_search
+        rows = None
+        if last is not None and last[0] == self._generation and _narrows(last[1], terms):
+            rows = last[2]
+        rows = self._match(terms, rows)
+        self._last_search = (self._generation, terms, rows)
+        # La vista recibe su propia copia: puede añadirle canales
+        return ChannelView(self, array('I', rows))
+
+    def _match(self, terms, rows=None):
+        """Filas no eliminadas (de rows, o de todo el almacén) que cumplen todos los terms"""
+        group_terms = [value for kind, value in terms if kind == 'group']
+        if group_terms:
+            folded = self._folded_groups
+            folded.extend(normalize_text(name) for name in self._group_names[len(folded):])
+            group_ok = bytearray(all(value in name for value in group_terms) for name in folded)
+            groups = self._groups
+            if rows is None:
+                rows = array('I', compress(range(len(groups)), [group_ok[group] for group in groups]))
+            else:
+                rows = array('I', [i for i in rows if group_ok[groups[i]]])
+        # Los términos más largos primero: suelen descartar más filas
+        for kind, value in sorted((term for term in terms if term[0] != 'group'), key=lambda t: -len(t[1])):
+            column = self._column(kind)
+            if rows is None:
+                rows = array('I', compress(range(len(column)), [value in text for text in column]))
+            else:
+                rows = array('I', [i for i in rows if value in column[i]])
+        if rows is None:
+            return array('I', self.order)
+        if self.has_removed():
+            deleted = self._deleted
+            rows = array('I', [i for i in rows if not deleted[i]])
+        return rows
+
+    def _compact_names(self):
+        """Nombres normalizados sin espacios ("La 1 HD" y "LA1 HD" dan "la1hd")"""
+        compact = self._compact
+        folded = self.folded_names()
+        if len(compact) < len(folded):
+            compact.extend(name.replace(' ', '') for name in folded[len(compact):])
+        return compact
+
+    def fuzzy_search(self, query, limit=FUZZY_LIMIT):
+        """
+        Búsqueda aproximada: vista con hasta limit canales cuyo nombre se
+        parece a query, de más a menos parecido. Se compara con los nombres
+        normalizados y sin espacios, así que "la1" encuentra "La 1 HD". Por
+        orden, puntúan:
+
+        1. los que empiezan por el texto buscado,
+        2. los que lo contienen (antes cuanto más al principio),
+        3. los que tienen sus letras en orden y juntas, aunque haya alguna
+           otra en medio ("antna" encuentra "Antena"),
+        4. con cuatro letras o más, los que lo contienen con un error (una
+           letra cambiada, de más o de menos, o dos intercambiadas); solo se
+           buscan si con lo anterior no se llega a limit,
+        5. los que tienen sus letras en orden pero muy separadas.
+
+        Los términos group: y url: se aplican como en search. Si se sigue
+        escribiendo, se puntúan solo las coincidencias anteriores, y de todas
+        solo se ordenan las limit mejores (heapq.nsmallest).
+        """
+        terms = parse_search(query)
+        needle = ''.join(value.replace(' ', '') for kind, value in terms if kind == 'name')
+        filters = tuple(term for term in terms if term[0] != 'name')
+        if not needle:
+            return self.search(query)
+        keys = self._compact_names()
+        last = self._last_fuzzy
+        if last is not None and last[:2] == (self._generation, filters) and needle.startswith(last[2]):
+            rows = last[3]
+        elif filters:
+            rows = self._match(filters)
+        else:
+            rows = None
+
+        # "[^a]*a[^n]*n...": cada letra se busca desde la anterior sin volver
+        # atrás, así que comprobar una clave cuesta lo que mide. El grupo marca
+        # dónde empieza la coincidencia para puntuar lo juntas que están
+        letters = [re.escape(c) for c in needle]
+        subsequence = re.compile('[^%s]*(%s)' % (letters[0], letters[0]) +
+                                 ''.join('[^%s]*%s' % (c, c) for c in letters[1:]))
+        if rows is None:
+            rows = range(len(keys))
+        if len(needle) == 1:
+            matched = array('I', [i for i in rows if needle in keys[i]])
+        else:
+            match = subsequence.match
+            matched = array('I', [i for i in rows if match(keys[i])])
+        self._last_fuzzy = (self._generation, filters, needle, matched)
+        if self.has_removed():
+            deleted = self._deleted
+            matched = [i for i in matched if not deleted[i]]
+
+        def score(i):
+            key = keys[i]
+            pos = key.find(needle)
+            if pos >= 0:
+                return (0 if pos == 0 else 1, pos, len(key))
+            found = subsequence.match(key)
+            span = found.end() - found.start(1)
+            # Letras muy separadas: detrás de las que tienen una errata
+            return (2 if span <= len(needle) + len(needle) // 2 else 4, span, len(key))
+
+        ranked = heapq.nsmallest(limit, matched, key=score)
+        if len(needle) >= 4 and (len(ranked) < limit or score(ranked[-1])[0] == 4):
+            scores = {i: score(i) for i in ranked}
+            scores.update(self._typo_rows(needle, filters, set(matched)))
+            ranked = heapq.nsmallest(limit, scores, key=scores.__getitem__)
+        return ChannelView(self, array('I', ranked))
+
+    def _typo_rows(self, needle, filters, seen):
+        """
+        Puntuación de las filas (fuera de seen) que contienen needle con un
+        error. Con un solo error, la primera o la segunda mitad de needle
+        aparece tal cual en la clave: se descartan primero las que no tienen
+        ninguna de las dos, que es mucho más rápido que probar la expresión.
+        """
+        keys = self._compact_names()
+        half = len(needle) // 2
+        head, tail = needle[:half], needle[half + 1:]
+        rows = self._match(filters) if filters else range(len(keys))
+        candidates = [i for i in rows if head in keys[i] or tail in keys[i]]
+        typo = _one_edit_pattern(needle).search
+        deleted = self._deleted
+        found = {}
+        for i in candidates:
+            if i not in seen and not deleted[i]:
+                match = typo(keys[i])
+                if match is not None:
+                    found[i] = (3, match.start(), len(keys[i]))
+        return found
+
+
+class ChannelView:
+    """
+    Vista de solo lectura (salvo append y remove) sobre un ChannelStore: se
+    comporta como una lista de pares (nombre, url) pero solo guarda los
+    índices de los canales visibles. Sin índices, muestra todo el almacén.
+    """
+
+    def __init__(self, store, indices=None):
+        self.store = store
+        self.indices = indices
+
+    def _rows(self):
+        return self.store.order if self.indices is None else self.indices
+
+    def __len__(self):
+        return len(self._rows())
+
+    def __getitem__(self, position):
+        return self.store[self._rows()[position]]
+
+    def __iter__(self):
+        store = self.store
+        for index in self._rows():
+            yield store[index]
+
+    def store_index(self, position):
+        """Índice en el almacén del canal que ocupa esa posición de la vista"""
+        return self._rows()[position]
+
+    def append(self, name, url, group=''):
+        """Añade un canal al almacén y a la vista"""
+        index = self.store.append(name, url, group)
+        if self.indices is not None:
+            self.indices.append(index)
+        return index
+
+    def remove(self, position):
+        """Quita el canal de la vista y del almacén"""
+        index = self._rows()[position]
+        if self.indices is not None:
+            del self.indices[position]
+        self.store.remove(index)
@@ -0,0 +1,388 @@
+import re
+from m3u_parser import extinf_field, normalize_field
+
+# Palabras reservadas del lenguaje de filtrado
+OPERATORS = ('AND', 'OR', 'NOT')
+
+# A partir de este número de literales se usa una expresión regular combinada
+# como prefiltro en lugar de una búsqueda "in" por literal
+COMBINED_THRESHOLD = 4
+
+
+def _tokenize(text):
+    """
+    Divide la expresión en tokens. Los espacios separan términos, los
+    paréntesis son siempre tokens propios y las comillas simples agrupan un
+    literal con espacios o paréntesis ('Deportes (HD)'). Las comillas dobles
+    no son especiales porque forman parte de los atributos M3U.
+    Devuelve una lista de pares (tipo, valor) con tipo 'op', 'term' o 'quoted'.
+    """
+    tokens = []
+    i = 0
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c.isspace():
+            i += 1
+        elif c in '()':
+            tokens.append(('op', c))
+            i += 1
+        elif c == "'":
+            end = text.find("'", i + 1)
+            if end < 0:
+                raise ValueError(f"Comilla simple sin cerrar en la posición {i}")
+            tokens.append(('quoted', text[i + 1:end]))
+            i = end + 1
+        else:
+            j = i
+            while j < n and not text[j].isspace() and text[j] not in "()'":
+                j += 1
+            # Permitir prefijos pegados a un literal entre comillas: re:'a b',
+            # -'x y', group:'Cine HD'
+            if j < n and text[j] == "'" and j > i and (text[i:j] == '-' or text[j - 1] == ':'):
+                end = text.find("'", j + 1)
+                if end < 0:
+                    raise ValueError(f"Comilla simple sin cerrar en la posición {j}")
+                tokens.append(('term', text[i:j] + text[j + 1:end]))
+                i = end + 1
+                continue
+            word = text[i:j]
+            tokens.append(('op', word) if word in OPERATORS else ('term', word))
+            i = j
+    return tokens
+
+
+def is_expression(text):
+    """
+    Indica si el texto usa la sintaxis de expresiones o es un patrón simple.
+    Los paréntesis solos no cuentan: "Canal+ (ES)" o "(HD)" siguen siendo
+    literales, como antes de existir las expresiones.
+    """
+    try:
+        tokens = _tokenize(text)
+    except ValueError:
+        return False
+    for kind, value in tokens:
+        if kind == 'quoted' or (kind == 'op' and value in OPERATORS):
+            return True
+        if value.startswith(('-', 're:')) and len(value) > 1:
+            return True
+        if _field_prefix(value)[0] is not None:
+            return True
+    return False
+
+
+def _field_prefix(value):
+    """Separa 'campo:valor' si campo es un campo #EXTINF conocido"""
+    field, sep, rest = value.partition(':')
+    if sep and field:
+        canonical = normalize_field(field)
+        if canonical is not None:
+            return canonical, rest
+    return None, value
+
+
+class _Parser:
+    """Analizador descendente recursivo que produce un árbol de tuplas"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("La expresión está vacía")
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError(f"Token inesperado: {self.peek()[1]}")
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.peek() == ('op', 'OR'):
+            self.take()
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while True:
+            token = self.peek()
+            if token == ('op', 'AND'):
+                self.take()
+                nodes.append(self.parse_not())
+            elif token is not None and token not in (('op', 'OR'), ('op', ')')):
+                # Dos términos seguidos equivalen a AND
+                nodes.append(self.parse_not())
+            else:
+                break
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def parse_not(self):
+        token = self.peek()
+        if token == ('op', 'NOT'):
+            self.take()
+            return ('not', self.parse_not())
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.take()
+        if token is None:
+            raise ValueError("Falta un término al final de la expresión")
+        kind, value = token
+        if token == ('op', '('):
+            node = self.parse_or()
+            if self.take() != ('op', ')'):
+                raise ValueError("Falta el paréntesis de cierre")
+            return node
+        if kind == 'op':
+            raise ValueError(f"Operador inesperado: {value}")
+        if kind == 'quoted':
+            return ('lit', value)
+        if value.startswith('-') and len(value) > 1:
+            return ('not', self._term(value[1:]))
+        return self._term(value)
+
+    def _term(self, value):
+        field, value = _field_prefix(value)
+        if value.startswith('re:'):
+            try:
+                re.compile(value[3:])
+            except re.error as e:
+                raise ValueError(f"Expresión regular no válida '{value[3:]}': {e}")
+            node = ('re', value[3:])
+        else:
+            node = ('lit', value)
+        if field is not None:
+            return ('field', field, node)
+        return node
+
+
+class FilterExpression:
+    """
+    Filtro compilado que se evalúa una sola vez por entrada #EXTINF.
+
+    Un patrón sin operadores se trata como un literal, igual que antes, de
+    modo que 'tvg-name="ES' sigue funcionando. La sintaxis completa admite:
+
+        group-title="Deportes" OR tvg-name="ES AND NOT XXX
+        (tvg-name="ES OR tvg-name="PT) -XXX re:'HD|FHD'
+
+    con AND (o simplemente términos seguidos), OR, NOT o '-', paréntesis,
+    comillas simples para literales con espacios y el prefijo re: para
+    expresiones regulares. Un término campo:valor (group-title:Cine,
+    tvg-name:re:^ES, name:'La 1') busca solo dentro de ese campo de la
+    cabecera (ver m3u_parser.FIELDS y FIELD_ALIASES). La coincidencia distingue mayúsculas, igual que el
+    filtro original. Funciona tanto con líneas str como con bytes.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        if is_expression(text):
+            self.tree = _Parser(_tokenize(text)).parse()
+        else:
+            self.tree = ('lit', text)
+        self.literals = []
+        self.regexes = []
+        # Términos campo:valor como (campo, tipo, patrón)
+        self.fields = []
+        self._collect(self.tree)
+        self._compiled = {}
+
+    @property
+    def is_literal(self):
+        """True si la expresión es un único literal sin operadores"""
+        return self.tree[0] == 'lit'
+
+    @property
+    def literal(self):
+        return self.tree[1] if self.is_literal else None
+
+    def _collect(self, node):
+        kind = node[0]
+        if kind == 'lit' and node[1] not in self.literals:
+            self.literals.append(node[1])
+        elif kind == 're' and node[1] not in self.regexes:
+            self.regexes.append(node[1])
+        elif kind in ('and', 'or'):
+            for child in node[1]:
+                self._collect(child)
+        elif kind == 'not':
+            self._collect(node[1])
+        elif kind == 'field':
+            term = (node[1],) + node[2]
+            if term not in self.fields:
+                self.fields.append(term)
+
+    @property
+    def requires_term(self):
+        """
+        True si ninguna línea puede cumplir la expresión sin contener alguno
+        de sus literales o expresiones regulares. En ese caso los motores
+        pueden saltar directamente de término en término.
+        """
+        if any(kind == 're' for _, kind, _ in self.fields):
+            # Una expresión regular de campo puede anclarse al valor (^ES) y
+            # no localizarse buscando en la línea completa
+            return False
+
+        def value(node):
+            kind = node[0]
+            if kind in ('lit', 're', 'field'):
+                return False
+            if kind == 'not':
+                return not value(node[1])
+            if kind == 'and':
+                return all(value(child) for child in node[1])
+            return any(value(child) for child in node[1])
+        return not value(self.tree)
+
+    def candidate_finder(self, as_bytes=False):
+        """
+        Devuelve el método search de una expresión regular que localiza
+        cualquier término de la expresión (literales como trie y expresiones
+        regulares). Solo es útil si requires_term es True. Se compila con
+        re.MULTILINE porque los motores buscan sobre el archivo entero: así
+        ^ y $ de un término re: siguen anclándose a cada línea.
+        """
+        parts = []
+        words = self.literals + [pattern for _, kind, pattern in self.fields if kind == 'lit']
+        if words:
+            parts.append(_trie_pattern(words))
+        parts.extend(f'(?:{r})' for r in self.regexes)
+        pattern = '|'.join(parts)
+        return re.compile(pattern.encode('utf-8') if as_bytes else pattern, re.MULTILINE).search
+
+    def matches(self, line):
+        """Evalúa la expresión sobre una línea str o bytes"""
+        return self.matcher(isinstance(line, bytes))(line)
+
+    def matcher(self, as_bytes=False):
+        """Devuelve la función de evaluación para líneas str o bytes"""
+        key = bytes if as_bytes else str
+        if key not in self._compiled:
+            self._compiled[key] = self._compile(as_bytes)
+        return self._compiled[key]
+
+    def _compile(self, as_bytes):
+        encode = (lambda s: s.encode('utf-8')) if as_bytes else (lambda s: s)
+        literals = {lit: encode(lit) for lit in self.literals}
+        regexes = {r: re.compile(encode(r)) for r in self.regexes}
+
+        if self.is_literal:
+            lit = literals[self.literal]
+            return lambda line: lit in line
+
+        def field_value(line, field):
+            if as_bytes:
+                line = line.decode('utf-8', errors='replace')
+            return extinf_field(line, field)
+
+        def make_field(field, kind, pattern):
+            if kind == 're':
+                search = re.compile(pattern).search
+                return lambda line: search(field_value(line, field)) is not None
+            return lambda line: pattern in field_value(line, field)
+
+        full = self._build(self.tree, lambda lit: (lambda line, s=literals[lit]: s in line),
+                           regexes, make_field)
+        words = self.literals + [pattern for _, kind, pattern in self.fields if kind == 'lit']
+        if len(words) < COMBINED_THRESHOLD:
+            # Pocos literales: cada término se comprueba con "in" de forma perezosa
+            return full
+
+        # Muchos literales: una única búsqueda con una alternancia en forma de
+        # trie descarta de golpe las líneas que no contienen ningún literal,
+        # que son la mayoría en un filtro selectivo. Para esas líneas se evalúa
+        # la expresión con todos los literales a falso; el valor de un campo
+        # es parte de la línea, así que tampoco puede contenerlo.
+        prefilter = re.compile(encode(_trie_pattern(words))).search
+
+        def make_absent_field(field, kind, pattern):
+            if kind == 're':
+                return make_field(field, kind, pattern)
+            return lambda line: False
+
+        absent = self._build(self.tree, lambda lit: (lambda line: False), regexes, make_absent_field)
+        return lambda line: full(line) if prefilter(line) is not None else absent(line)
+
+    def _build(self, tree, make_literal, regexes, make_field):
+        """Convierte el árbol en una función que recibe la línea"""
+        def build(node):
+            kind = node[0]
+            if kind == 'lit':
+                return make_literal(node[1])
+            if kind == 're':
+                search = regexes[node[1]].search
+                return lambda line: search(line) is not None
+            if kind == 'field':
+                return make_field(node[1], *node[2])
+            if kind == 'not':
+                child = build(node[1])
+                return lambda line: not child(line)
+            children = [build(child) for child in node[1]]
+            if kind == 'and':
+                return lambda line: all(child(line) for child in children)
+            return lambda line: any(child(line) for child in children)
+
+        return build(tree)
+
+
+def _trie_pattern(words):
+    """
+    Construye una expresión regular equivalente a la alternancia de las
+    palabras pero factorizada como un trie, de modo que el coste por
+    posición depende de la profundidad del trie y no del número de palabras.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def build(node):
+        alternatives = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch != '']
+        if not alternatives:
+            return ''
+        body = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+        if '' in node:
+            body = '(?:' + body + ')?'
+        return body
+
+    return build(trie)
+
+
+def compile_filter(text):
+    """Compila el texto del patrón en un FilterExpression"""
+    return FilterExpression(text)
+
+
+def combine_patterns(patterns):
+    """
+    Une varios patrones con OR en una sola expresión. Las expresiones se
+    agrupan entre paréntesis y los literales con espacios o paréntesis se
+    ponen entre comillas simples, igual que el botón "Añadir con OR".
+    """
+    patterns = [p for p in patterns if p]
+    if len(patterns) == 1:
+        return patterns[0]
+    terms = []
+    for pattern in patterns:
+        if is_expression(pattern):
+            terms.append(f'({pattern})')
+        elif any(c in pattern for c in " ()'"):
+            if "'" in pattern:
+                raise ValueError(f"No se puede combinar el literal {pattern!r} porque contiene una comilla simple")
+            terms.append(f"'{pattern}'")
+        else:
+            terms.append(pattern)
+    return ' OR '.join(terms)
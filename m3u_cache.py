@@ -0,0 +1,490 @@
+import hashlib
+import io
+import json
+import mmap
+import os
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import m3u_io
+from channel_store import ChannelStore
+from filter_expression import compile_filter
+from m3u_filter import ENGINES, EXTINF, SCAN_STEP, _block_to_channel, _scan_entries, _scan_range
+
+# Bytes que se comparan al principio del archivo y justo antes del final
+# anterior para comprobar que solo ha crecido por el final
+SAMPLE_BYTES = 64 * 1024
+
+# Límites de cada carpeta de caché: tamaño total y días sin usarse tras
+# los que se borra una entrada (ver prune_cache)
+FILTER_CACHE_BYTES = 512 * 1024 * 1024
+HTTP_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+SNAPSHOT_CACHE_BYTES = 512 * 1024 * 1024
+CACHE_DAYS = 30
+FILTER_CACHE_DAYS = CACHE_DAYS
+
+# Extensiones de los archivos de las cachés, y las que marcan el último uso
+_CACHE_EXTENSIONS = ('.json', '.m3u', '.store')
+_USE_EXTENSIONS = ('.json', '.store')
+
+
+def cache_dir(name):
+    """
+    Carpeta de caché para el apartado indicado. Por defecto está en
+    ~/.cache/kidneysm3u; se puede cambiar con la variable de entorno
+    KIDNEYSM3U_CACHE.
+    """
+    base = os.environ.get('KIDNEYSM3U_CACHE') or os.path.join(os.path.expanduser('~'), '.cache', 'kidneysm3u')
+    path = os.path.join(base, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def prune_cache(directory, max_bytes, max_days, used_path=None):
+    """
+    Aplica los límites a una carpeta de caché. Los archivos con el mismo
+    nombre (clave.json, clave.m3u...) son una entrada, y la fecha de
+    modificación de su .json o .store marca su último uso; used_path, el de
+    la entrada que se acaba de usar, se marca antes. Se borran las entradas
+    con más de max_days días sin usarse y, si aun así ocupan más de
+    max_bytes, las usadas hace más tiempo (también la última si ella sola
+    pasa del límite).
+    """
+    if used_path is not None and os.path.exists(used_path):
+        os.utime(used_path)
+    entries = {}
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        base, ext = os.path.splitext(name)
+        if ext not in _CACHE_EXTENSIONS:
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        size, used = entries.get(base, (0, 0))
+        # Un archivo sin el que marca el uso (interrumpido) cuenta como el más antiguo
+        entries[base] = (size + stat.st_size, max(used, stat.st_mtime) if ext in _USE_EXTENSIONS else used)
+    oldest = time.time() - max_days * 24 * 3600
+    total = sum(size for size, _ in entries.values())
+    for base, (size, used) in sorted(entries.items(), key=lambda item: item[1][1]):
+        if used >= oldest and total <= max_bytes:
+            break
+        for ext in _CACHE_EXTENSIONS:
+            try:
+                os.remove(os.path.join(directory, base + ext))
+            except FileNotFoundError:
+                pass
+        total -= size
+
+
+def _sample_hash(f, end):
+    """Huella de los primeros y los últimos SAMPLE_BYTES de f[0:end]"""
+    digest = hashlib.blake2b(digest_size=16)
+    f.seek(0)
+    digest.update(f.read(min(SAMPLE_BYTES, end)))
+    tail = max(0, end - SAMPLE_BYTES)
+    f.seek(tail)
+    digest.update(f.read(end - tail))
+    return digest.hexdigest()
+
+
+def _last_entry_start(mm, end):
+    """Posición de la última línea #EXTINF de mm[0:end], o end si no hay ninguna"""
+    pos = mm.rfind(b'\n' + EXTINF, 0, end)
+    if pos >= 0:
+        return pos + 1
+    return 0 if mm[:len(EXTINF)] == EXTINF else end
+
+
+class FilterCache:
+    """
+    Caché de resultados del filtro por (ruta de entrada, patrón). Cada
+    entrada son dos archivos en la carpeta de caché: el M3U con las
+    coincidencias y un JSON con la huella de la entrada (tamaño, fecha de
+    modificación y huella de los extremos) y el byte hasta el que se ha
+    procesado.
+
+    - Si la entrada no ha cambiado, el resultado sale de la caché.
+    - Si solo ha crecido por el final (mismo principio y mismos bytes
+      antes del final anterior), se procesa solo lo nuevo.
+    - En cualquier otro caso se filtra de nuevo todo el archivo.
+
+    La última entrada del archivo se vuelve a evaluar siempre porque puede
+    haberse completado al crecer. Los duplicados (m3u_dedup) se descartan al
+    copiar el resultado a la salida, nunca dentro de la caché.
+
+    La carpeta no crece sin límite: tras cada filtrado se aplican
+    max_bytes y max_days con prune_cache.
+    """
+
+    def __init__(self, directory=None, max_bytes=FILTER_CACHE_BYTES, max_days=FILTER_CACHE_DAYS):
+        self.directory = directory or cache_dir('filtros')
+        self.max_bytes = max_bytes
+        self.max_days = max_days
+
+    def _paths(self, input_path, pattern):
+        key = hashlib.blake2b(f'{os.path.abspath(input_path)}\0{pattern}'.encode('utf-8'),
+                              digest_size=16).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + '.json', base + '.m3u'
+
+    def _load_meta(self, meta_path, result_path):
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(result_path) or os.path.getsize(result_path) != meta.get('result_size'):
+            return None
+        return meta
+
+    def _save_meta(self, meta_path, meta):
+        tmp = meta_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+    def filter(self, input_path, output_path, pattern, mode='w', progress_queue=None, stop_event=None,
+               dedup=None, engine='mmap'):
+        """
+        Igual que los motores de m3u_filter, pero reutilizando el resultado
+        de ejecuciones anteriores con la misma entrada y el mismo patrón.
+        engine es el motor que se usa si hay que filtrar el archivo entero.
+
+        Devuelve (canales, detenido).
+        """
+        try:
+            return self._filter(input_path, output_path, pattern, mode, progress_queue, stop_event,
+                                dedup, engine)
+        finally:
+            prune_cache(self.directory, self.max_bytes, self.max_days, self._paths(input_path, pattern)[0])
+
+    def _filter(self, input_path, output_path, pattern, mode, progress_queue, stop_event, dedup, engine):
+        expression = compile_filter(pattern)
+        meta_path, result_path = self._paths(input_path, pattern)
+        stat = os.stat(input_path)
+        meta = self._load_meta(meta_path, result_path)
+        compressed = m3u_io.detect_compression(input_path) is not None
+
+        if compressed or stat.st_size == 0:
+            # Un archivo comprimido no se puede leer a partir de un byte
+            # concreto: solo se reutiliza si no ha cambiado
+            if not (meta and meta['size'] == stat.st_size and meta['mtime'] == stat.st_mtime_ns):
+                channels, stopped = ENGINES[engine](input_path, result_path, pattern, 'w',
+                                                    progress_queue, stop_event)
+                if stopped:
+                    return self._discard(meta_path, result_path, channels)
+                self._save_meta(meta_path, {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                                            'offset': None, 'result_size': os.path.getsize(result_path)})
+            return self._write_output(result_path, None, None, output_path, mode, dedup)
+
+        with open(input_path, 'rb') as infile, \
+             mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            start = self._resume_offset(meta, infile, stat)
+            end = _last_entry_start(mm, size)
+            if start is None and (engine == 'lineas' or (engine == 'paralelo' and end > SCAN_STEP * 4)):
+                # Primera vez con el motor por líneas, o con un archivo grande
+                # en modo paralelo: se filtra entero con ese motor y se quita
+                # de la caché la última entrada
+                channels, stopped = ENGINES[engine](input_path, result_path, pattern, 'w',
+                                                    progress_queue, stop_event)
+                if stopped:
+                    return self._discard(meta_path, result_path, channels)
+                self._drop_last_entry(result_path, mm, end)
+            elif start is None:
+                with open(result_path, 'wb') as cached:
+                    cached.write(b'#EXTM3U\n')
+                meta = None
+                start = 0
+            if start is not None and start < end:
+                stopped = self._extend(result_path, mm, start, end, expression, progress_queue, stop_event)
+                if stopped and meta is None:
+                    return self._discard(meta_path, result_path, [])
+                if stopped:
+                    # Se deja la caché como estaba para continuar la próxima vez
+                    with open(result_path, 'r+b') as cached:
+                        cached.truncate(meta['result_size'])
+                    return [], True
+            self._save_meta(meta_path, {
+                'size': size,
+                'mtime': stat.st_mtime_ns,
+                'sample': _sample_hash(infile, size),
+                'offset': end,
+                'result_size': os.path.getsize(result_path),
+            })
+            return self._write_output(result_path, mm, (end, size, expression), output_path, mode, dedup)
+
+    def _resume_offset(self, meta, infile, stat):
+        """Byte desde el que continuar, o None si hay que filtrar todo"""
+        if not meta or meta.get('offset') is None:
+            return None
+        old_size = meta['size']
+        if stat.st_size == old_size and stat.st_mtime_ns == meta['mtime']:
+            return meta['offset']
+        if stat.st_size > old_size and _sample_hash(infile, old_size) == meta.get('sample'):
+            return meta['offset']
+        return None
+
+    def _extend(self, result_path, mm, start, end, expression, progress_queue, stop_event):
+        """Añade a la caché las coincidencias de mm[start:end]. Devuelve detenido."""
+        total = len(mm) or 1
+
+        def progress(pos):
+            if progress_queue is not None:
+                progress_queue.put(('progreso', (pos / total) * 100))
+
+        with open(result_path, 'ab') as cached, memoryview(mm) as view:
+            _, stopped = _scan_range(mm, view, start, end, expression, cached, stop_event, progress)
+        return stopped
+
+    def _drop_last_entry(self, result_path, mm, end):
+        """Quita del resultado el bloque de la última entrada si se llegó a copiar"""
+        block = mm[end:]
+        if not block:
+            return
+        if not block.endswith(b'\n'):
+            block += b'\n'
+        size = os.path.getsize(result_path)
+        with open(result_path, 'r+b') as cached:
+            if size >= len(block):
+                cached.seek(size - len(block))
+                if cached.read() == block:
+                    cached.truncate(size - len(block))
+
+    def _discard(self, meta_path, result_path, channels):
+        """Tras una cancelación la caché queda a medias: se borra"""
+        for path in (meta_path, result_path):
+            if os.path.exists(path):
+                os.remove(path)
+        return channels, True
+
+    def _write_output(self, result_path, mm, tail, output_path, mode, dedup):
+        """
+        Copia a la salida las entradas de la caché y, si se indica tail como
+        (inicio, fin, expresión), evalúa además las de mm[inicio:fin].
+        """
+        accept = None if dedup is None else (lambda block: dedup.add(*_block_to_channel(block)))
+        channels = []
+        with m3u_io.open_output(output_path, mode) as outfile:
+            if mode == 'w':
+                outfile.write(b'#EXTM3U\n')
+            if os.path.getsize(result_path):
+                with open(result_path, 'rb') as cached, \
+                     mmap.mmap(cached.fileno(), 0, access=mmap.ACCESS_READ) as cm, \
+                     memoryview(cm) as view:
+                    matches, _ = _scan_entries(cm, view, 0, len(cm), lambda line: True, outfile,
+                                               accept=accept)
+                    channels.extend(_block_to_channel(cm[a:b]) for a, b in matches)
+            if tail is not None and tail[0] < tail[1]:
+                start, end, expression = tail
+                with memoryview(mm) as view:
+                    matches, _ = _scan_range(mm, view, start, end, expression, outfile, accept=accept)
+                channels.extend(_block_to_channel(mm[a:b]) for a, b in matches)
+        return channels, False
+
+
+def filter_m3u_cached(input_path, output_path, pattern, mode='w', progress_queue=None, stop_event=None,
+                      dedup=None, engine='mmap'):
+    """Atajo de FilterCache().filter con la carpeta de caché por defecto"""
+    return FilterCache().filter(input_path, output_path, pattern, mode, progress_queue, stop_event,
+                                dedup, engine)
+
+
+class _CachingReader(io.RawIOBase):
+    """
+    Flujo de lectura sobre una respuesta HTTP que guarda lo recibido en un
+    archivo temporal. Si se lee hasta el final, al cerrarlo el temporal
+    pasa a ser la copia en caché; si no (cancelación o error), se borra.
+    """
+
+    def __init__(self, response, tmp_path, on_complete):
+        self.response = response
+        self.tmp_path = tmp_path
+        self.tmp = open(tmp_path, 'wb')
+        self.on_complete = on_complete
+        self.complete = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.response.readinto(b)
+        if n:
+            self.tmp.write(memoryview(b)[:n])
+        elif len(b):
+            self.complete = True
+        return n
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.response.close()
+                self.tmp.close()
+                if self.complete:
+                    self.on_complete(self.tmp_path)
+            finally:
+                if os.path.exists(self.tmp_path):
+                    os.remove(self.tmp_path)
+        super().close()
+
+
+class HttpCache:
+    """
+    Caché en disco de listas remotas. Se guarda el cuerpo tal como llega
+    (comprimido con gzip si el servidor lo envía así) junto con su ETag y
+    Last-Modified, y en las siguientes peticiones se revalida con
+    If-None-Match / If-Modified-Since:
+
+    - 304 Not Modified: se lee la copia guardada, sin descargar nada.
+    - 200: se lee la respuesta mientras se descarga y, si se completa,
+      sustituye a la copia guardada.
+    - Sin conexión: se usa la copia guardada si la hay.
+
+    Cada vez que se guarda una copia se aplican max_bytes y max_days a la
+    carpeta (ver prune_cache).
+    """
+
+    def __init__(self, directory=None, max_bytes=HTTP_CACHE_BYTES, max_days=CACHE_DAYS):
+        self.directory = directory or cache_dir('http')
+        self.max_bytes = max_bytes
+        self.max_days = max_days
+
+    def _paths(self, url):
+        key = hashlib.blake2b(url.encode('utf-8'), digest_size=16).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + '.json', base + '.m3u'
+
+    def cached_path(self, url):
+        """Ruta de la copia guardada de url, o None si no hay ninguna"""
+        meta_path, body_path = self._paths(url)
+        if os.path.exists(meta_path) and os.path.exists(body_path):
+            return body_path
+        return None
+
+    def open(self, url, timeout=60):
+        """
+        Igual que m3u_io.open_url, pero pasando por la caché. Devuelve
+        (flujo, tamaño, copia): tamaño es el de lo que se va a leer, para el
+        progreso, y copia la ruta de la copia guardada si el flujo sale de
+        ella, o None si viene del servidor.
+        """
+        meta_path, body_path = self._paths(url)
+        meta = None
+        if self.cached_path(url):
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = None
+        headers = dict(m3u_io.REQUEST_HEADERS)
+        if meta and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta and meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and meta:
+                e.close()
+                os.utime(meta_path)
+                return m3u_io.open_binary(body_path), os.path.getsize(body_path), body_path
+            raise
+        except (urllib.error.URLError, OSError):
+            if meta:
+                os.utime(meta_path)
+                return m3u_io.open_binary(body_path), os.path.getsize(body_path), body_path
+            raise
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not (etag or last_modified):
+            # Sin validadores no se podría revalidar: no se guarda copia
+            return m3u_io.open_response(response) + (None,)
+
+        def store(tmp_path):
+            os.replace(tmp_path, body_path)
+            tmp_meta = meta_path + '.tmp'
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump({'url': url, 'etag': etag, 'last_modified': last_modified}, f)
+            os.replace(tmp_meta, meta_path)
+            prune_cache(self.directory, self.max_bytes, self.max_days, meta_path)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            reader = _CachingReader(response, tmp_path, store)
+        except Exception:
+            response.close()
+            os.remove(tmp_path)
+            raise
+        return m3u_io.open_response(response, reader) + (None,)
+
+
+def open_url_cached(url, timeout=60):
+    """Atajo de HttpCache().open con la carpeta de caché por defecto"""
+    return HttpCache().open(url, timeout)
+
+
+class SnapshotCache:
+    """
+    Copia ya procesada de las listas cargadas en el reproductor. Al cargar
+    una lista local (o la copia de una remota, ver HttpCache) se guarda su
+    ChannelStore en un archivo binario, identificado por la ruta de la
+    lista, y la próxima vez se lee de una vez en lugar de analizar el M3U
+    línea a línea. Solo se usa si la lista tiene el mismo tamaño, la misma
+    fecha de modificación y la misma huella de los extremos.
+
+    Cada vez que se guarda una copia se aplican max_bytes y max_days a la
+    carpeta (ver prune_cache).
+    """
+
+    def __init__(self, directory=None, max_bytes=SNAPSHOT_CACHE_BYTES, max_days=CACHE_DAYS):
+        self.directory = directory or cache_dir('listas')
+        self.max_bytes = max_bytes
+        self.max_days = max_days
+
+    def _path(self, input_path):
+        key = hashlib.blake2b(os.path.abspath(input_path).encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.directory, key + '.store')
+
+    def fingerprint(self, input_path):
+        """Huella actual de input_path (tamaño, fecha y extremos), sin leer la copia guardada"""
+        stat = os.stat(input_path)
+        with open(input_path, 'rb') as f:
+            sample = _sample_hash(f, stat.st_size)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sample': sample}
+
+    def load(self, input_path):
+        """
+        Devuelve (almacén, huella): el ChannelStore guardado de input_path, o
+        None si no hay o ya no vale, y la huella actual del archivo, que hay
+        que pasar a save() para que la copia corresponda a lo que se leyó.
+        """
+        fingerprint = self.fingerprint(input_path)
+        path = self._path(input_path)
+        if not os.path.exists(path):
+            return None, fingerprint
+        try:
+            store, meta = ChannelStore.load(path)
+        except (OSError, ValueError, KeyError):
+            return None, fingerprint
+        if meta != fingerprint:
+            return None, fingerprint
+        os.utime(path)
+        return store, fingerprint
+
+    def save(self, input_path, store, fingerprint):
+        """Guarda store como la copia procesada de input_path con esa huella"""
+        if store.has_removed():
+            # Ya no refleja el contenido del archivo
+            return
+        path = self._path(input_path)
+        store.save(path, fingerprint)
+        prune_cache(self.directory, self.max_bytes, self.max_days, path)
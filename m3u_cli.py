@@ -0,0 +1,138 @@
+"""
+Filtro de listas M3U desde la línea de comandos, sin interfaz gráfica.
+
+Hace lo mismo que el botón "Procesar" de la ventana principal pero no
+importa tkinter, vlc ni yt_dlp, de modo que arranca al instante y se puede
+usar en tareas programadas (cron) o en equipos sin pantalla:
+
+    python m3u_cli.py lista.m3u -p 'tvg-name="ES' -o espana.m3u
+    python m3u_cli.py https://ejemplo.com/lista.m3u.gz -p 'group:Deportes' -p 'group:Cine' \\
+        -o salida.m3u.gz --append --dedup url --engine paralelo
+    python m3u_cli.py lista.m3u --reemplazar host viejo.servidor.com nuevo.servidor.com -o nueva.m3u
+"""
+import argparse
+import os
+import sys
+from filter_expression import combine_patterns, compile_filter
+from m3u_cache import filter_m3u_cached
+from m3u_dedup import DEDUP_KEYS, DedupIndex
+from m3u_filter import ENGINES, filter_m3u_url
+from m3u_io import is_url
+from m3u_transform import TRANSFORM_FIELDS, Replacement, transform_m3u
+
+class _Progress:
+    """Cola mínima que muestra en stderr los mensajes ('progreso', porcentaje)"""
+
+    def __init__(self):
+        self.last = -1
+
+    def put(self, message):
+        percent = int(message[1])
+        if percent != self.last:
+            self.last = percent
+            sys.stderr.write(f'\r{percent:3d}%')
+            sys.stderr.flush()
+
+    def finish(self):
+        if self.last >= 0:
+            sys.stderr.write('\r100%\n')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='m3u_cli.py',
+        description='Filtra una lista M3U (local, remota o comprimida) sin abrir la interfaz gráfica.')
+    parser.add_argument('entrada', help='ruta del archivo M3U o URL http(s)')
+    parser.add_argument('-p', '--patron', action='append', dest='patrones',
+                        help='patrón o expresión de filtrado; si se repite, se combinan con OR')
+    parser.add_argument('--reemplazar', nargs=3, action='append', dest='reemplazos',
+                        metavar=('CAMPO', 'BUSCAR', 'REEMPLAZO'),
+                        help='reemplazar texto en un campo (%s) de cada canal copiado; '
+                             'se puede repetir' % ', '.join(field for field, _ in TRANSFORM_FIELDS))
+    parser.add_argument('--regex', action='store_true',
+                        help='en --reemplazar, BUSCAR es una expresión regular')
+    parser.add_argument('--ignorar-mayusculas', action='store_true',
+                        help='en --reemplazar, no distinguir mayúsculas al buscar')
+    parser.add_argument('-o', '--salida', required=True,
+                        help='archivo de salida (.gz, .xz o .zst para guardarlo comprimido)')
+    parser.add_argument('-a', '--append', action='store_true',
+                        help='añadir al final del archivo de salida en lugar de sobrescribirlo')
+    parser.add_argument('--dedup', choices=DEDUP_KEYS,
+                        help='no escribir canales repetidos, comparando por esta clave')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='mmap',
+                        help='motor de filtrado (por defecto: mmap)')
+    parser.add_argument('--paralelo', action='store_const', const='paralelo', dest='engine',
+                        help='atajo de --engine paralelo')
+    parser.add_argument('--cache', action='store_true',
+                        help='reutilizar el resultado anterior si la entrada no ha cambiado o solo ha crecido')
+    parser.add_argument('-q', '--quiet', action='store_true', help='no mostrar progreso ni resumen')
+    return parser
+
+
+def main(argv=None):
+    """Punto de entrada de la línea de comandos. Devuelve el código de salida."""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.patrones and not args.reemplazos:
+        parser.error('hay que indicar al menos un --patron o un --reemplazar')
+    pattern = None
+    if args.patrones:
+        try:
+            pattern = combine_patterns(args.patrones)
+            compile_filter(pattern)
+        except ValueError as e:
+            print(f'Patrón de búsqueda no válido: {e}', file=sys.stderr)
+            return 2
+    replacements = []
+    for field, find, replacement in args.reemplazos or ():
+        try:
+            replacements.append(Replacement(field, find, replacement, args.regex, args.ignorar_mayusculas))
+        except ValueError as e:
+            print(f'Reemplazo no válido: {e}', file=sys.stderr)
+            return 2
+
+    mode = 'a' if args.append else 'w'
+    progress = None if args.quiet or not sys.stderr.isatty() else _Progress()
+    input_path = args.entrada
+    remote = is_url(input_path)
+    if not remote and not os.path.isfile(input_path):
+        print(f'No existe el archivo de entrada: {input_path}', file=sys.stderr)
+        return 1
+    try:
+        dedup = DedupIndex.for_output(args.salida, args.dedup, mode) if args.dedup else None
+        if replacements:
+            # Con reemplazos se reescribe cada entrada: se lee como flujo de
+            # entradas (local o remota) en lugar de copiar bloques
+            channels, changed = transform_m3u(input_path, args.salida, replacements, pattern, mode, dedup)
+        elif remote:
+            # La lista remota se filtra mientras se descarga, sin guardarla
+            channels, _ = filter_m3u_url(input_path, args.salida, pattern, mode,
+                                         progress_queue=progress, dedup=dedup)
+        elif args.cache:
+            channels, _ = filter_m3u_cached(input_path, args.salida, pattern, mode,
+                                            progress_queue=progress, dedup=dedup, engine=args.engine)
+        else:
+            channels, _ = ENGINES[args.engine](input_path, args.salida, pattern, mode,
+                                               progress_queue=progress, dedup=dedup)
+    except KeyboardInterrupt:
+        print('\nInterrumpido: el archivo de salida puede estar incompleto', file=sys.stderr)
+        return 130
+    except Exception as e:
+        print(f'Error al procesar el archivo: {e}', file=sys.stderr)
+        return 1
+
+    if progress is not None:
+        progress.finish()
+    if not args.quiet:
+        written = channels if replacements else len(channels)
+        summary = f'{written} canales escritos en {args.salida}'
+        if replacements:
+            summary += f', {changed} modificados'
+        if dedup is not None and dedup.skipped:
+            summary += f' ({dedup.skipped} duplicados omitidos)'
+        print(summary, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+import hashlib
+import math
+import os
+import re
+from m3u_parser import extinf_field, extinf_name, normalize_lines, normalize_text, read_entries
+
+# Claves de duplicado disponibles
+DEDUP_KEYS = ('url', 'tvg-id', 'name')
+
+# Por encima de este tamaño del archivo de salida existente se usa un filtro
+# de Bloom en lugar de un conjunto de huellas
+BLOOM_THRESHOLD_BYTES = 256 * 1024 * 1024
+
+# Tamaño medio estimado de una entrada #EXTINF + URL, para dimensionar el
+# filtro de Bloom a partir del tamaño del archivo
+AVERAGE_ENTRY_BYTES = 150
+
+
+class BloomFilter:
+    """
+    Filtro de Bloom sobre un bytearray con doble hash a partir de blake2b.
+    Puede dar falsos positivos (con la probabilidad indicada) pero nunca
+    falsos negativos.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1024)
+        self.size = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, digest):
+        """Añade la huella (16 bytes) y devuelve False si ya estaba"""
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        bits = self.bits
+        present = True
+        for i in range(self.hashes):
+            pos = (h1 + i * h2) % self.size
+            byte, mask = pos >> 3, 1 << (pos & 7)
+            if not bits[byte] & mask:
+                present = False
+                bits[byte] |= mask
+        return not present
+
+
+class DedupIndex:
+    """
+    Índice de entradas ya escritas para el modo "Añadir al final" sin
+    duplicados. Guarda huellas de la clave elegida:
+
+    - 'url': la URL de la entrada.
+    - 'tvg-id': el atributo tvg-id (si falta, se usa la URL).
+    - 'name': el nombre visible normalizado (ver m3u_parser.normalize_text).
+
+    Con pocas entradas usa un conjunto de huellas de 8 bytes; con archivos
+    grandes, un filtro de Bloom que ocupa una fracción de la memoria a
+    cambio de descartar por error alguna entrada nueva muy de vez en cuando.
+    """
+
+    def __init__(self, key='url', capacity=0, use_bloom=False):
+        if key not in DEDUP_KEYS:
+            raise ValueError(f"Clave de duplicados no válida: {key}")
+        self.key = key
+        self.skipped = 0
+        if use_bloom:
+            self._bloom = BloomFilter(capacity)
+            self._seen = None
+        else:
+            self._bloom = None
+            self._seen = set()
+
+    @classmethod
+    def for_output(cls, output_path, key='url', mode='a'):
+        """
+        Crea el índice para un archivo de salida. En modo 'a' se cargan las
+        entradas que ya contiene; en modo 'w' empieza vacío y solo evita
+        duplicados dentro de la propia ejecución.
+        """
+        size = os.path.getsize(output_path) if mode == 'a' and os.path.exists(output_path) else 0
+        use_bloom = size > BLOOM_THRESHOLD_BYTES
+        # Margen para las entradas que se añadirán en esta ejecución
+        index = cls(key, capacity=2 * size // AVERAGE_ENTRY_BYTES, use_bloom=use_bloom)
+        if size:
+            index.load(output_path)
+        return index
+
+    def load(self, path):
+        """Añade al índice las entradas de un archivo M3U existente"""
+        for entry in read_entries(path):
+            self._add(self._digest(*entry.text()))
+
+    def key_of(self, extinf, url):
+        """Calcula la clave de una entrada según el modo elegido"""
+        if self.key == 'tvg-id':
+            return extinf_field(extinf, 'tvg-id').strip() or url.strip()
+        if self.key == 'name':
+            return normalize_text(extinf_name(extinf)) or url.strip()
+        return url.strip()
+
+    def _digest(self, extinf, url):
+        size = 16 if self._bloom is not None else 8
+        return hashlib.blake2b(self.key_of(extinf, url).encode('utf-8'), digest_size=size).digest()
+
+    def _add(self, digest):
+        if self._bloom is not None:
+            return self._bloom.add(digest)
+        if digest in self._seen:
+            return False
+        self._seen.add(digest)
+        return True
+
+    def add(self, extinf, url):
+        """Registra la entrada y devuelve True si es nueva, False si es un duplicado"""
+        if self._add(self._digest(extinf, url)):
+            return True
+        self.skipped += 1
+        return False
+
+
+# Palabras que no distinguen un canal de otro al buscar nombres parecidos
+NOISE_WORDS = frozenset({
+    'hd', 'fhd', 'uhd', 'sd', '4k', '8k', 'hq', 'lq', 'hevc', 'h264', 'h265', 'x264', 'x265',
+    '720p', '1080p', '1080i', '2160p', '50fps', '60fps', 'backup', 'alt', 'vip', 'tv', 'live',
+})
+
+# Prefijo de país o idioma al principio del nombre: "ES: ", "[ES] ", "UK | "
+_COUNTRY_PREFIX_RE = re.compile(r'^\s*(?:\[[^\]]{1,4}\]|\([^)]{1,4}\)|[A-Za-z]{2,3}\s*[:|])\s*')
+_NUMBERS_RE = re.compile(r'\d+')
+_URL_RE = re.compile(r'([A-Za-z][\w+.-]*)://([^/?#@]*@)?(\[[^\]]*\]|[^:/?#]*)(:\d*)?([^#]*)')
+_DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+
+# Vecinos (en el orden de las claves) con los que se compara cada nombre
+NEAR_WINDOW = 4
+
+
+def normalize_url(url):
+    """
+    URL para comparar: sin espacios, con el esquema y el servidor en
+    minúsculas, sin el puerto por defecto ni el fragmento (#...). Con una
+    expresión regular en vez de urllib.parse, que es bastante más lento
+    para cientos de miles de URL.
+    """
+    url = url.strip()
+    match = _URL_RE.match(url)
+    if match is None:
+        return url
+    scheme, user, host, port, rest = match.groups('')
+    scheme = scheme.lower()
+    if port == _DEFAULT_PORTS.get(scheme):
+        port = ''
+    return f"{scheme}://{user}{host.lower()}{port}{rest or '/'}"
+
+
+def url_host(url):
+    """
+    Servidor (en minúsculas) de una URL, o '' si no tiene. Con la misma
+    expresión regular que normalize_url en vez de urlsplit, que es varias
+    veces más lento con cientos de miles de URL.
+    """
+    match = _URL_RE.match(url.strip())
+    return match.group(3).strip('[]').lower() if match else ''
+
+
+def name_keys(names):
+    """
+    Claves de nombre para buscar canales parecidos: sin prefijo de país,
+    normalizados (m3u_parser.normalize_lines, todos de una vez), sin
+    NOISE_WORDS y sin espacios. "ES: Antena 3 HD" y "Antena3" dan "antena3".
+    """
+    stripped = [_COUNTRY_PREFIX_RE.sub('', name, count=1).replace('\n', ' ') for name in names]
+    keys = []
+    for folded in normalize_lines('\n'.join(stripped)).split('\n'):
+        keys.append(''.join(word for word in folded.split(' ') if word not in NOISE_WORDS))
+    return keys
+
+
+def _within_edits(a, b, limit):
+    """Indica si a y b se diferencian en limit ediciones (Levenshtein) o menos"""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other)))
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+def find_duplicates(names, urls, near=True):
+    """
+    Grupos de canales repetidos a partir de sus nombres y URL (listas
+    paralelas). Devuelve una lista de grupos, cada uno con las posiciones
+    de sus canales en orden creciente, ordenados por su primer canal.
+
+    - Iguales: la misma URL normalizada (normalize_url), con un diccionario.
+    - Parecidos (con near): la misma clave de nombre (name_keys) o, si solo
+      se diferencian en una o dos letras, también. Para no comparar todos
+      con todos, se ordenan las claves y cada una solo se compara con sus
+      NEAR_WINDOW vecinas, en el orden normal y en el de las claves al
+      revés (así se encuentran también las diferencias del principio). Dos
+      nombres con números distintos ("Canal 1" y "Canal 2") nunca se
+      consideran el mismo canal.
+    """
+    parent = list(range(len(urls)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        i, j = find(i), find(j)
+        if i != j:
+            parent[max(i, j)] = min(i, j)
+
+    first = {}
+    for position, url in enumerate(urls):
+        key = normalize_url(url)
+        if key:
+            union(first.setdefault(key, position), position)
+
+    if near:
+        keys = name_keys(names)
+        numbers = [_NUMBERS_RE.findall(key) for key in keys]
+        for order_key in (None, lambda i: keys[i][::-1]):
+            order = sorted((i for i in range(len(keys)) if keys[i]),
+                           key=order_key or keys.__getitem__)
+            for n, i in enumerate(order):
+                key = keys[i]
+                limit = 1 if len(key) < 10 else 2
+                for j in order[n + 1:n + 1 + NEAR_WINDOW]:
+                    other = keys[j]
+                    if other == key:
+                        union(i, j)
+                    elif (len(key) >= 4 and numbers[i] == numbers[j]
+                          and _within_edits(key, other, limit)):
+                        union(i, j)
+
+    groups = {}
+    for position in range(len(parent)):
+        groups.setdefault(find(position), []).append(position)
+    return [group for root, group in sorted(groups.items()) if len(group) > 1]
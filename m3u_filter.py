@@ -0,0 +1,429 @@
+import io
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import multiprocessing
+from filter_expression import compile_filter
+from m3u_parser import iter_entries
+import m3u_io
+
+# Tamaño de la ventana de búsqueda del motor mmap. Entre ventana y ventana se
+# publica el progreso y se comprueba la cancelación.
+SCAN_STEP = 8 * 1024 * 1024
+EXTINF = b'#EXTINF'
+
+# Tamaño mínimo de cada trozo del modo paralelo. Por debajo de dos trozos
+# no compensa arrancar procesos y se usa el motor mmap directamente.
+PARALLEL_CHUNK = 32 * 1024 * 1024
+
+
+def filter_m3u(input_path, output_path, pattern, mode='w', progress_queue=None, stop_event=None, dedup=None):
+    """
+    Filtra un archivo M3U copiando al archivo de salida las entradas cuyo
+    #EXTINF cumple el patrón, que puede ser un literal o una expresión de
+    filtrado (ver filter_expression). No usa tkinter, por lo que puede ejecutarse
+    en un hilo de fondo: el progreso se publica en progress_queue como
+    ('progreso', porcentaje) y la cancelación se comprueba en stop_event.
+    Si se pasa un m3u_dedup.DedupIndex, las entradas que ya contiene se
+    descartan en lugar de escribirse de nuevo.
+
+    Lee el archivo como un flujo de entradas (ver m3u_parser.read_entries),
+    así que admite entradas comprimidas (ver m3u_io) y es el motor al que
+    recurren los demás cuando no pueden mapear el archivo.
+
+    Devuelve (canales, detenido) donde canales es la lista de pares
+    (extinf, url) encontrados.
+    """
+    matches = compile_filter(pattern).matcher(as_bytes=True)
+    file_size = os.path.getsize(input_path)
+    with m3u_io.open_binary(input_path) as infile, \
+         m3u_io.open_output(output_path, mode) as outfile:
+        return _filter_stream(infile, file_size, outfile, mode, matches, progress_queue, stop_event, dedup)
+
+
+def filter_m3u_url(url, output_path, pattern, mode='w', progress_queue=None, stop_event=None, dedup=None):
+    """
+    Variante de filter_m3u que lee una lista remota directamente de la
+    respuesta HTTP, por bloques y sin guardarla en disco ni en memoria. El
+    progreso se calcula con el Content-Length; si el servidor no lo envía,
+    no se publica progreso.
+
+    Devuelve (canales, detenido) igual que filter_m3u.
+    """
+    matches = compile_filter(pattern).matcher(as_bytes=True)
+    infile, length = m3u_io.open_url(url)
+    with infile, m3u_io.open_output(output_path, mode) as outfile:
+        return _filter_stream(infile, length, outfile, mode, matches,
+                              progress_queue if length else None, stop_event, dedup)
+
+
+def _filter_stream(infile, total, outfile, mode, matches, progress_queue=None, stop_event=None, dedup=None):
+    """
+    Núcleo de filter_m3u y filter_m3u_url: recorre las entradas de un flujo
+    binario con m3u_parser.iter_entries y copia a outfile los bloques cuyo
+    #EXTINF cumple matches, igual que el motor mmap. total es el tamaño del
+    origen para calcular el progreso.
+    """
+    channels = []
+    total = total or 1
+    buffer = []
+    buffer_size = 2000  # Número de bloques a acumular antes de escribir
+    update_interval = 1000  # Publicar el progreso cada N entradas
+    entries_since_update = 0
+    stopped = False
+
+    if mode == 'w':
+        outfile.write(b'#EXTM3U\n')
+
+    for entry in iter_entries(infile):
+        entries_since_update += 1
+        if matches(entry.extinf):
+            channel = entry.text()
+            if dedup is None or dedup.add(*channel):
+                buffer.extend(entry.lines)
+                if not entry.lines[-1].endswith(b'\n'):
+                    buffer.append(b'\n')
+                channels.append(channel)
+
+        # Escribir buffer y publicar progreso cada cierto número de entradas
+        if len(buffer) >= buffer_size * 2:
+            outfile.writelines(buffer)
+            buffer.clear()
+        if entries_since_update >= update_interval:
+            entries_since_update = 0
+            if stop_event is not None and stop_event.is_set():
+                stopped = True
+                break
+            if progress_queue is not None:
+                progress_queue.put(('progreso', min(100, (m3u_io.read_position(infile) / total) * 100)))
+
+    # Escribir lo que quede en el buffer antes de salir
+    if buffer:
+        outfile.writelines(buffer)
+
+    return channels, stopped
+
+
+def _has_url(mm, start, end):
+    """
+    Indica si el bloque mm[start:end] tiene alguna línea de URL (no vacía y
+    que no empieza por '#'), igual que exige m3u_parser.iter_entries: los
+    bloques con solo #EXTVLCOPT o líneas en blanco se descartan.
+    """
+    line_end = mm.find(b'\n', start, end)
+    # Lo normal es que la URL sea la línea siguiente al #EXTINF
+    first = mm[line_end + 1:line_end + 2] if line_end >= 0 else b''
+    if first and first not in b'#\r\n\t ':
+        return True
+    while 0 <= line_end < end - 1:
+        line_start = line_end + 1
+        line_end = mm.find(b'\n', line_start, end)
+        line = mm[line_start:end if line_end < 0 else line_end]
+        if line.strip() and not line.startswith(b'#'):
+            return True
+    return False
+
+
+def _scan_range(mm, view, start, end, expression, outfile, stop_event=None, progress=None, accept=None):
+    """
+    Recorre mm[start:end] directamente sobre los bytes y copia al archivo de
+    salida cada bloque #EXTINF (cabecera, opciones y URL) que cumple la
+    expresión. Con un literal se salta de coincidencia en coincidencia con
+    mmap.find; con una expresión compuesta se salta de término en término
+    (o de #EXTINF en #EXTINF si la expresión puede cumplirse sin ninguno,
+    como NOT XXX) y se evalúa cada cabecera una sola vez. Una entrada pertenece al rango que
+    contiene el inicio de su línea #EXTINF, de modo que los rangos se pueden
+    procesar por separado. Si se pasa accept, solo se copian los bloques
+    para los que accept(bloque) devuelve True. Devuelve (posiciones
+    (inicio, fin) copiadas, detenido).
+    """
+    if expression.is_literal:
+        needle = expression.literal.encode('utf-8') or EXTINF
+        finder = test = None
+    else:
+        needle = EXTINF
+        test = expression.matcher(as_bytes=True)
+        finder = expression.candidate_finder(as_bytes=True) if expression.requires_term else None
+    if test is not None and finder is None:
+        return _scan_entries(mm, view, start, end, test, outfile, stop_event, progress, accept)
+    matches = []
+    size = len(mm)
+    pos = start
+    stopped = False
+    # Los bloques contiguos se acumulan en una única escritura
+    run_start = run_end = -1
+    next_check = pos
+    while pos < end:
+        if pos >= next_check:
+            if stop_event is not None and stop_event.is_set():
+                stopped = True
+                break
+            if progress is not None and pos > start:
+                progress(pos)
+            next_check = pos + SCAN_STEP
+        limit = min(pos + SCAN_STEP, end)
+        if finder is not None:
+            # Los términos no cruzan líneas: se amplía la ventana hasta el
+            # final de la línea en la que cae el límite
+            window_end = mm.find(b'\n', limit, end) if limit < end else end
+            found = finder(mm, pos, end if window_end < 0 else window_end)
+            hit = -1 if found is None else found.start()
+        else:
+            hit = mm.find(needle, pos, min(limit + len(needle) - 1, end))
+        if hit < 0:
+            pos = limit
+            continue
+
+        line_start = mm.rfind(b'\n', 0, hit) + 1
+        if line_start < start or mm.find(EXTINF, line_start, line_start + len(EXTINF)) != line_start:
+            # El patrón está en una URL u otra línea, o en una entrada ajena
+            line_end = mm.find(b'\n', hit)
+            pos = size if line_end < 0 else line_end + 1
+            continue
+
+        next_entry = mm.find(b'\n' + EXTINF, hit)
+        block_end = size if next_entry < 0 else next_entry + 1
+        pos = block_end
+        line_end = mm.find(b'\n', hit, block_end)
+        if line_end < 0 or not _has_url(mm, line_start, block_end):
+            # #EXTINF sin URL detrás
+            continue
+        if test is not None and not test(mm[line_start:line_end]):
+            continue
+        if accept is not None and not accept(mm[line_start:block_end]):
+            continue
+        matches.append((line_start, block_end))
+        if line_start != run_end:
+            if run_end > run_start:
+                outfile.write(view[run_start:run_end])
+            run_start = line_start
+        run_end = block_end
+
+    if run_end > run_start:
+        outfile.write(view[run_start:run_end])
+        if run_end == size and mm[size - 1:size] != b'\n':
+            outfile.write(b'\n')
+    return matches, stopped
+
+
+def _scan_entries(mm, view, start, end, test, outfile, stop_event=None, progress=None, accept=None):
+    """
+    Variante de _scan_range para expresiones que pueden cumplirse sin ningún
+    término (NOT XXX): recorre todas las entradas del rango saltando de
+    #EXTINF en #EXTINF y evalúa cada cabecera.
+    """
+    matches = []
+    size = len(mm)
+    stopped = False
+    run_start = run_end = -1
+    if mm.find(EXTINF, start, start + len(EXTINF)) == start and (start == 0 or mm[start - 1:start] == b'\n'):
+        pos = start
+    else:
+        pos = mm.find(b'\n' + EXTINF, start, end)
+        pos = end if pos < 0 else pos + 1
+    entries = 0
+    while pos < end:
+        entries += 1
+        if entries % 4096 == 0:
+            if stop_event is not None and stop_event.is_set():
+                stopped = True
+                break
+            if progress is not None:
+                progress(pos)
+        line_end = mm.find(b'\n', pos)
+        if line_end < 0:
+            break
+        next_entry = mm.find(b'\n' + EXTINF, line_end)
+        block_end = size if next_entry < 0 else next_entry + 1
+        if _has_url(mm, pos, block_end) and test(mm[pos:line_end]) and \
+                (accept is None or accept(mm[pos:block_end])):
+            matches.append((pos, block_end))
+            if pos != run_end:
+                if run_end > run_start:
+                    outfile.write(view[run_start:run_end])
+                run_start = pos
+            run_end = block_end
+        pos = block_end
+
+    if run_end > run_start:
+        outfile.write(view[run_start:run_end])
+        if run_end == size and mm[size - 1:size] != b'\n':
+            outfile.write(b'\n')
+    return matches, stopped
+
+
+def _block_to_channel(block):
+    """
+    Convierte un bloque de bytes #EXTINF en el par (extinf, url). La URL es
+    la primera línea no vacía que no empieza por '#', como en
+    m3u_parser.iter_entries.
+    """
+    extinf, _, rest = block.decode('utf-8', errors='replace').partition('\n')
+    url = next((line for line in rest.splitlines() if line.strip() and not line.startswith('#')), '')
+    return extinf.strip(), url.strip()
+
+
+def filter_m3u_mmap(input_path, output_path, pattern, mode='w', progress_queue=None, stop_event=None,
+                    dedup=None):
+    """
+    Variante de filter_m3u que mapea el archivo en memoria y evalúa el patrón
+    sobre bytes, saltando entre entradas sin decodificar líneas. Los bloques
+    coincidentes se copian tal cual a la salida. Un archivo comprimido no se
+    puede mapear, así que en ese caso se usa el motor por líneas.
+
+    Devuelve (canales, detenido) igual que filter_m3u.
+    """
+    expression = compile_filter(pattern)
+    if m3u_io.detect_compression(input_path):
+        return filter_m3u(input_path, output_path, pattern, mode, progress_queue, stop_event, dedup)
+    file_size = os.path.getsize(input_path)
+
+    with m3u_io.open_output(output_path, mode) as outfile:
+        if mode == 'w':
+            outfile.write(b'#EXTM3U\n')
+        if file_size == 0:
+            return [], False
+
+        def progress(pos):
+            if progress_queue is not None:
+                progress_queue.put(('progreso', (pos / file_size) * 100))
+
+        with open(input_path, 'rb') as infile, \
+             mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                accept = None if dedup is None else (lambda block: dedup.add(*_block_to_channel(block)))
+                matches, stopped = _scan_range(mm, view, 0, file_size, expression, outfile,
+                                               stop_event, progress, accept)
+            channels = [_block_to_channel(mm[a:b]) for a, b in matches]
+
+    return channels, stopped
+
+
+def _chunk_bounds(mm, chunk_size):
+    """Divide el archivo en rangos que empiezan siempre en una línea #EXTINF"""
+    size = len(mm)
+    bounds = [0]
+    while True:
+        target = bounds[-1] + chunk_size
+        if target >= size:
+            break
+        cut = mm.find(b'\n' + EXTINF, target)
+        if cut < 0:
+            break
+        bounds.append(cut + 1)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _filter_chunk(input_path, start, end, pattern):
+    """
+    Trabajo de un proceso del modo paralelo: filtra mm[start:end] y devuelve
+    los bytes de salida, los canales encontrados y la longitud de cada bloque.
+    """
+    expression = compile_filter(pattern)
+    out = io.BytesIO()
+    with open(input_path, 'rb') as infile, \
+         mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as view:
+            matches, _ = _scan_range(mm, view, start, end, expression, out)
+        channels = [_block_to_channel(mm[a:b]) for a, b in matches]
+    return out.getvalue(), channels, [b - a for a, b in matches]
+
+
+def filter_m3u_parallel(input_path, output_path, pattern, mode='w', progress_queue=None, stop_event=None,
+                        dedup=None, workers=None, chunk_size=None):
+    """
+    Variante de filter_m3u_mmap que reparte el archivo en trozos cortados en
+    fronteras #EXTINF y los filtra en un pool de procesos. Los resultados se
+    escriben en el orden original y el progreso combina los trozos ya
+    terminados de todos los procesos. Al cancelar no se lanzan más trozos y
+    se descartan los pendientes. Los duplicados se descartan en este
+    proceso, al escribir en orden, para que el resultado no dependa del
+    reparto.
+
+    Devuelve (canales, detenido) igual que filter_m3u.
+    """
+    compile_filter(pattern)  # Validar antes de arrancar los procesos
+    workers = workers or os.cpu_count() or 1
+    file_size = os.path.getsize(input_path)
+    if chunk_size is None:
+        chunk_size = max(PARALLEL_CHUNK, file_size // (workers * 4) + 1)
+    if workers < 2 or file_size < 2 * chunk_size or m3u_io.detect_compression(input_path):
+        return filter_m3u_mmap(input_path, output_path, pattern, mode, progress_queue, stop_event, dedup)
+
+    with open(input_path, 'rb') as infile, \
+         mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        ranges = _chunk_bounds(mm, chunk_size)
+
+    channels = []
+    stopped = False
+    done_bytes = 0
+    results = {}
+    next_to_write = 0
+    next_to_submit = 0
+    pending = {}
+
+    # 'spawn' evita heredar el estado de Tk y de los hilos del proceso padre
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        with m3u_io.open_output(output_path, mode) as outfile:
+            if mode == 'w':
+                outfile.write(b'#EXTM3U\n')
+
+            while next_to_write < len(ranges):
+                if stop_event is not None and stop_event.is_set():
+                    stopped = True
+                    break
+
+                # Mantener como mucho dos trozos en cola por proceso
+                while next_to_submit < len(ranges) and len(pending) < workers * 2:
+                    start, end = ranges[next_to_submit]
+                    future = pool.submit(_filter_chunk, input_path, start, end, pattern)
+                    pending[future] = next_to_submit
+                    next_to_submit += 1
+
+                finished, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index = pending.pop(future)
+                    results[index] = future.result()
+                    start, end = ranges[index]
+                    done_bytes += end - start
+
+                # Escribir en orden los trozos ya disponibles
+                while next_to_write in results:
+                    data, chunk_channels, lengths = results.pop(next_to_write)
+                    if dedup is None:
+                        outfile.write(data)
+                        channels.extend(chunk_channels)
+                    else:
+                        _write_new_blocks(outfile, data, chunk_channels, lengths, dedup, channels)
+                    next_to_write += 1
+
+                if finished and progress_queue is not None:
+                    progress_queue.put(('progreso', (done_bytes / file_size) * 100))
+    finally:
+        # Sin esperar a los trozos en curso para que la cancelación sea inmediata
+        pool.shutdown(wait=not stopped, cancel_futures=True)
+
+    return channels, stopped
+
+
+def _write_new_blocks(outfile, data, chunk_channels, lengths, dedup, channels):
+    """Escribe solo los bloques de un trozo que no estaban ya en el índice"""
+    pos = 0
+    last = len(lengths) - 1
+    for i, (length, channel) in enumerate(zip(lengths, chunk_channels)):
+        # El último bloque puede llevar el salto de línea final añadido
+        end = len(data) if i == last else pos + length
+        if dedup.add(*channel):
+            outfile.write(data[pos:end])
+            channels.append(channel)
+        pos = end
+
+
+# Motores de filtrado disponibles
+ENGINES = {
+    'lineas': filter_m3u,
+    'mmap': filter_m3u_mmap,
+    'paralelo': filter_m3u_parallel,
+}
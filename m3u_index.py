@@ -0,0 +1,572 @@
+import heapq
+import mmap
+import os
+from array import array
+from collections import deque
+from itertools import compress
+import m3u_io
+from m3u_filter import EXTINF, _has_url
+
+# Ediciones de M3USorter que se pueden deshacer
+UNDO_LIMIT = 200
+
+# Canales editados a partir de los cuales IndexedChannels.compact libera
+# los que ya no se usan
+COMPACT_MIN = 4096
+
+
+class M3UIndex:
+    """
+    Índice de las entradas de un archivo M3U sin comprimir: una sola pasada
+    guarda en dos arrays dónde empieza y dónde acaba cada entrada, y el
+    texto de cada una se lee del archivo (con mmap) solo cuando se pide.
+    Así se pueden abrir listas más grandes que la memoria: lo único que
+    ocupa memoria son esos arrays, dieciséis bytes por entrada.
+
+    Los bloques son los mismos que genera m3u_parser.iter_entries: desde un
+    #EXTINF hasta el siguiente, descartando los que no tienen URL.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        self.starts = array('q')
+        self.ends = array('q')
+        self._build()
+
+    @classmethod
+    def supports(cls, path):
+        """Solo se indexan archivos locales, no vacíos y sin comprimir"""
+        return (not m3u_io.is_url(path) and os.path.getsize(path) > 0
+                and m3u_io.detect_compression(path) is None)
+
+    def _build(self):
+        mm = self._mm
+        size = len(mm)
+        find = mm.find
+        starts, ends = self.starts, self.ends
+        pos = 0 if mm[:len(EXTINF)] == EXTINF else find(b'\n' + EXTINF)
+        if pos > 0:
+            pos += 1
+        while pos >= 0:
+            following = find(b'\n' + EXTINF, pos)
+            end = size if following < 0 else following + 1
+            if _has_url(mm, pos, end):
+                starts.append(pos)
+                ends.append(end)
+            pos = following + 1 if following >= 0 else -1
+
+    def __len__(self):
+        return len(self.starts)
+
+    def block(self, i):
+        """Bytes del bloque de la entrada i tal como están en el archivo"""
+        return self._mm[self.starts[i]:self.ends[i]]
+
+    def entry(self, i):
+        """
+        Entrada i como el par (extinf, cuerpo) que usa M3USorter: la línea
+        #EXTINF y el resto del bloque, ambos terminados en salto de línea.
+        """
+        text = self.block(i).decode('utf-8', errors='replace').replace('\r\n', '\n')
+        extinf, _, body = text.partition('\n')
+        return extinf + '\n', body.strip('\n') + '\n'
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+def _without(items, indices):
+    """Copia de items (lista o array) sin las posiciones indices, en una pasada"""
+    keep = bytearray(b'\x01') * len(items)
+    for i in indices:
+        keep[i] = 0
+    result = items[:0]
+    result.extend(compress(items, keep))
+    return result
+
+
+def _with(items, indices, values):
+    """
+    Copia de items con values insertados de forma que queden en las
+    posiciones indices (crecientes) del resultado, en una pasada.
+    """
+    result = items[:0]
+    start = 0
+    for i, value in zip(indices, values):
+        count = i - len(result)
+        result.extend(items[start:start + count])
+        start += count
+        result.append(value)
+    result.extend(items[start:])
+    return result
+
+
+class ChannelList(list):
+    """
+    Lista de canales (extinf, cuerpo) en memoria con las operaciones por
+    lotes de IndexedChannels: take y put quitan o insertan muchas filas con
+    una sola pasada, y las "fichas" que devuelven son los propios canales.
+    """
+
+    def tokens(self, indices):
+        return [self[i] for i in indices]
+
+    def set_tokens(self, indices, tokens):
+        for i, token in zip(indices, tokens):
+            self[i] = token
+
+    def tokens_for(self, channels):
+        return list(channels)
+
+    def take(self, indices):
+        tokens = self.tokens(indices)
+        self[:] = _without(self, indices)
+        return tokens
+
+    def put(self, indices, tokens):
+        self[:] = _with(self, indices, tokens)
+
+    def reorder(self, permutation):
+        self[:] = [self[i] for i in permutation]
+
+    def compact(self, tokens):
+        """Nada que hacer: las fichas son los propios canales y se liberan solas"""
+        return None
+
+
+class IndexedChannels:
+    """
+    Lista de canales (extinf, cuerpo) de M3USorter respaldada por un
+    M3UIndex. Cada fila es un número en un array: si es >= 0, la entrada del
+    archivo con ese número (se lee al pedirla); si es negativo, un canal
+    editado o pegado guardado en memoria. Admite lo que el ordenador hace
+    con una lista: leer, asignar, insertar, quitar y recorrer.
+
+    Las operaciones por lotes (take, put, tokens...) trabajan con esos
+    números ("fichas"), así que mover o deshacer no lee ninguna entrada.
+    Los canales editados que ya no usa ninguna fila ni ninguna edición que
+    se pueda deshacer se liberan con compact().
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.rows = array('q', range(len(index)))
+        self.edited = []
+        # Canales editados que quedaron tras la última compactación
+        self.kept = 0
+
+    def _ref(self, channel):
+        self.edited.append(channel)
+        return -len(self.edited)
+
+    def _channel(self, row):
+        return self.index.entry(row) if row >= 0 else self.edited[-1 - row]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        for row in self.rows:
+            yield self._channel(row)
+
+    def __getitem__(self, i):
+        return self._channel(self.rows[i])
+
+    def __setitem__(self, i, channel):
+        if isinstance(i, slice):
+            self.rows[i] = array('q', [self._ref(c) for c in channel])
+        else:
+            self.rows[i] = self._ref(channel)
+
+    def __delitem__(self, i):
+        del self.rows[i]
+
+    def insert(self, i, channel):
+        self.rows.insert(i, self._ref(channel))
+
+    def append(self, channel):
+        self.rows.append(self._ref(channel))
+
+    def pop(self, i=-1):
+        channel = self[i]
+        del self.rows[i]
+        return channel
+
+    def tokens(self, indices):
+        return array('q', [self.rows[i] for i in indices])
+
+    def set_tokens(self, indices, tokens):
+        for i, token in zip(indices, tokens):
+            self.rows[i] = token
+
+    def tokens_for(self, channels):
+        return array('q', [self._ref(c) for c in channels])
+
+    def take(self, indices):
+        tokens = self.tokens(indices)
+        self.rows = _without(self.rows, indices)
+        return tokens
+
+    def put(self, indices, tokens):
+        self.rows = _with(self.rows, indices, tokens)
+
+    def reorder(self, permutation):
+        rows = self.rows
+        self.rows = array('q', [rows[i] for i in permutation])
+
+    def compact(self, tokens):
+        """
+        Quita de edited los canales que no usa ninguna fila ni ninguna de
+        las fichas de tokens (un iterable de listas de fichas: las de undo y
+        redo). Solo lo hace cuando edited ha crecido al doble desde la
+        última vez (y tiene al menos COMPACT_MIN canales), así que el coste
+        se reparte entre las ediciones y tokens no se recorre en las demás.
+        Devuelve un dict ficha antigua -> ficha nueva para actualizar esas
+        listas, o None si no se ha compactado.
+        """
+        if len(self.edited) < max(COMPACT_MIN, 2 * self.kept):
+            return None
+        used = {row for row in self.rows if row < 0}
+        for group in tokens:
+            used.update(token for token in group if token < 0)
+        remap = {}
+        edited = []
+        # -1, -2, ...: se conserva el orden en que se guardaron
+        for token in sorted(used, reverse=True):
+            edited.append(self.edited[-1 - token])
+            remap[token] = -len(edited)
+        self.edited = edited
+        self.kept = len(edited)
+        self.rows = array('q', [remap.get(row, row) for row in self.rows])
+        return remap
+
+
+class FilteredChannels:
+    """
+    Lo que muestra la lista de M3USorter: todos los canales de channels o,
+    tras filter(), solo los que contienen el texto buscado. Las posiciones
+    de esta secuencia son las filas de la lista; rows guarda a qué canal de
+    channels corresponde cada una, así que leer, asignar, insertar o quitar
+    filas de una lista filtrada modifica los canales correctos.
+
+    key(canal) da el texto con el que se compara la búsqueda. Se calcula
+    para todos los canales la primera vez que se filtra y después se
+    mantiene al modificarlos; si se sigue escribiendo, solo se recorren las
+    filas del filtro anterior.
+
+    column(canales, criterio) da las claves de ordenación de un criterio
+    para una lista de canales, todas de una vez (ver m3u_sort.sort_column).
+    Igual que las de búsqueda, se calculan para toda la lista la primera
+    vez que se ordena por ese criterio y después se mantienen al editar
+    (solo se calculan las de los canales nuevos o cambiados), así que
+    volver a ordenar no normaliza de nuevo todos los nombres.
+
+    Las ediciones (delete, insert, replace, move, sort) se aplican por lotes: cada
+    una es una o dos pasadas sobre channels (ChannelList o IndexedChannels)
+    sea cual sea el número de filas, y se apuntan para undo y redo como la
+    operación contraria (las posiciones y las fichas de los canales), no
+    como copias de la lista.
+    """
+
+    def __init__(self, channels, key, column=None):
+        self.channels = channels
+        self.key = key
+        self.keys = None
+        self.column = column
+        # Claves de ordenación ya calculadas: criterio -> una por canal
+        self.columns = {}
+        self.rows = None
+        self.term = ''
+        self.undo_log = deque(maxlen=UNDO_LIMIT)
+        self.redo_log = []
+
+    def filter(self, term):
+        """Deja visibles los canales cuya clave contiene term ('' los muestra todos)"""
+        if not term:
+            self.rows = None
+            self.term = ''
+            return
+        if self.keys is None:
+            self.keys = [self.key(channel) for channel in self.channels]
+        keys = self.keys
+        if self.rows is not None and self.term and term.startswith(self.term):
+            candidates = self.rows
+        else:
+            candidates = range(len(keys))
+        self.rows = array('q', [i for i in candidates if term in keys[i]])
+        self.term = term
+
+    def source_index(self, position):
+        """Índice en channels del canal que ocupa esa fila"""
+        return position if self.rows is None else self.rows[position]
+
+    def _source_position(self, position):
+        """Índice en channels en el que se inserta delante de esa fila"""
+        if self.rows is None:
+            return position
+        return self.rows[position] if position < len(self.rows) else len(self.channels)
+
+    def __len__(self):
+        return len(self.channels) if self.rows is None else len(self.rows)
+
+    def __getitem__(self, position):
+        return self.channels[self.source_index(position)]
+
+    def __iter__(self):
+        if self.rows is None:
+            return iter(self.channels)
+        return (self.channels[i] for i in self.rows)
+
+    def __setitem__(self, position, channel):
+        if isinstance(position, slice):
+            # Lo usa VirtualListbox.insert: lista[i:i] = canales
+            self.insert(position.indices(len(self))[0], list(channel))
+        else:
+            self.replace([position], [channel])
+
+    def __delitem__(self, position):
+        if not isinstance(position, slice):
+            position = slice(position, position + 1)
+        self.delete(range(*position.indices(len(self))))
+
+    # --- Ediciones por lotes ---
+
+    def delete(self, positions):
+        """Quita las filas positions (crecientes)"""
+        if positions:
+            self._do([('take', array('q', map(self.source_index, positions)))])
+
+    def insert(self, position, channels):
+        """Inserta channels delante de la fila position; devuelve sus filas"""
+        if not channels:
+            return range(0)
+        position = min(position, len(self))
+        index = self._source_position(position)
+        indices = array('q', range(index, index + len(channels)))
+        self._do([('put', indices, self.channels.tokens_for(channels), None)])
+        return range(position, position + len(channels))
+
+    def replace(self, positions, channels):
+        """Sustituye los canales de las filas positions por channels"""
+        if positions:
+            indices = array('q', map(self.source_index, positions))
+            self._do([('set', indices, self.channels.tokens_for(channels))])
+
+    def move(self, positions, position, merge=False):
+        """
+        Mueve las filas positions (crecientes) para que empiecen en la fila
+        position de la lista sin ellas. Con merge se deshace junto con la
+        edición anterior (los pasos de un mismo arrastre). Devuelve las
+        filas en que quedan.
+        """
+        if not positions:
+            return range(0)
+        tokens = self.channels.tokens(map(self.source_index, positions))
+        keys = None if self.keys is None else [self.keys[self.source_index(p)] for p in positions]
+        columns = {field: [column[self.source_index(p)] for p in positions]
+                   for field, column in self.columns.items()}
+        operations = [('take', array('q', map(self.source_index, positions)))]
+        self._do(operations, merge)
+        index = self._source_position(position)
+        indices = array('q', range(index, index + len(tokens)))
+        self._do([('put', indices, tokens, keys, columns)], merge=True)
+        return range(position, position + len(tokens))
+
+    def sort(self, fields):
+        """
+        Ordena las filas visibles, de forma estable, dentro de los huecos
+        que ocupan (sin filtro, toda la lista), por los criterios fields en
+        orden: el segundo decide entre los que empatan en el primero, y así
+        sucesivamente. Devuelve False si ya estaban en orden.
+        """
+        if not fields:
+            raise ValueError("No se ha indicado ningún criterio de ordenación")
+        channels = self.channels
+        missing = [field for field in fields if field not in self.columns]
+        if missing:
+            # Los canales se leen una sola vez para todos los criterios nuevos
+            everything = list(channels)
+            for field in missing:
+                self.columns[field] = self.column(everything, field)
+        slots = range(len(channels)) if self.rows is None else self.rows
+        columns = [self.columns[field] for field in fields]
+        if self.rows is not None:
+            columns = [[column[i] for i in slots] for column in columns]
+        keys = columns[0] if len(columns) == 1 else list(zip(*columns))
+        order = sorted(range(len(slots)), key=keys.__getitem__)
+        if all(i == position for position, i in enumerate(order)):
+            return False
+        permutation = array('q', range(len(channels)))
+        for slot, position in zip(slots, order):
+            permutation[slot] = slots[position]
+        self._do([('order', permutation)])
+        return True
+
+    def undo(self):
+        """Deshace la última edición; devuelve False si no había ninguna"""
+        if not self.undo_log:
+            return False
+        inverse = self._apply(self.undo_log.pop())
+        self.redo_log.append(inverse)
+        self._compact()
+        return True
+
+    def redo(self):
+        """Rehace la última edición deshecha; devuelve False si no había ninguna"""
+        if not self.redo_log:
+            return False
+        inverse = self._apply(self.redo_log.pop())
+        self.undo_log.append(inverse)
+        self._compact()
+        return True
+
+    def _do(self, operations, merge=False):
+        inverse = self._apply(operations)
+        self.redo_log.clear()
+        if merge and self.undo_log:
+            # La contraria de la edición combinada: primero la de la última
+            self.undo_log[-1] = inverse + self.undo_log[-1]
+        else:
+            self.undo_log.append(inverse)
+        self._compact()
+
+    def _logged_tokens(self):
+        """Fichas de canales que guardan las ediciones de undo y redo"""
+        for log in (self.undo_log, self.redo_log):
+            for operations in log:
+                for operation in operations:
+                    if operation[0] in ('put', 'set'):
+                        yield operation[2]
+
+    def _compact(self):
+        """
+        Libera los canales editados que ya no usa nada: las ediciones que
+        salen de undo_log (por UNDO_LIMIT) o de redo_log dejan de
+        retenerlos, así que la memoria no crece con el número de ediciones.
+        """
+        remap = self.channels.compact(self._logged_tokens())
+        if remap is None:
+            return
+        for log in (self.undo_log, self.redo_log):
+            for operations in log:
+                operations[:] = [
+                    operation[:2] + (array('q', [remap.get(t, t) for t in operation[2]]),) + operation[3:]
+                    if operation[0] in ('put', 'set') else operation
+                    for operation in operations
+                ]
+
+    def _apply(self, operations):
+        """Aplica operaciones y devuelve las contrarias, en el orden en que deshacerlas"""
+        inverse = []
+        for operation in operations:
+            inverse.insert(0, self._apply_one(*operation))
+        return inverse
+
+    def _apply_one(self, kind, indices, tokens=None, keys=None, columns=None):
+        """
+        Una operación sobre channels (índices crecientes de channels):
+
+        - ('take', índices): quita esos canales,
+        - ('put', índices, fichas, claves, columnas): inserta las fichas
+          para que queden en esos índices (claves y columnas son las de
+          búsqueda y ordenación que tenían, o None para calcularlas),
+        - ('set', índices, fichas): sustituye esos canales,
+        - ('order', permutación): el canal i pasa a ser el que estaba en
+          permutación[i].
+
+        Mantiene las claves de búsqueda y de ordenación y las filas
+        visibles, y devuelve la operación contraria.
+        """
+        channels = self.channels
+        if kind == 'order':
+            permutation = indices
+            channels.reorder(permutation)
+            if self.keys is not None:
+                keys = self.keys
+                self.keys = [keys[i] for i in permutation]
+            for field, column in self.columns.items():
+                self.columns[field] = [column[i] for i in permutation]
+            inverse = array('q', bytes(8 * len(permutation)))
+            for position, i in enumerate(permutation):
+                inverse[i] = position
+            if self.rows is not None:
+                self.rows = array('q', sorted(inverse[i] for i in self.rows))
+            return ('order', inverse)
+        if kind == 'take':
+            old_keys = None if self.keys is None else [self.keys[i] for i in indices]
+            old_columns = {field: [column[i] for i in indices] for field, column in self.columns.items()}
+            tokens = channels.take(indices)
+            if self.keys is not None:
+                self.keys = _without(self.keys, indices)
+            for field, column in self.columns.items():
+                self.columns[field] = _without(column, indices)
+            if self.rows is not None:
+                self.rows = _rows_after_take(self.rows, indices)
+            return ('put', indices, tokens, old_keys, old_columns)
+        if kind == 'put':
+            channels.put(indices, tokens)
+            if self.keys is not None:
+                if keys is None:
+                    keys = [self.key(channels[i]) for i in indices]
+                self.keys = _with(self.keys, indices, keys)
+            if self.columns:
+                added = None
+                for field, column in self.columns.items():
+                    values = (columns or {}).get(field)
+                    if values is None:
+                        if added is None:
+                            added = [channels[i] for i in indices]
+                        values = self.column(added, field)
+                    self.columns[field] = _with(column, indices, values)
+            if self.rows is not None:
+                # Los canales insertados (o recuperados) quedan visibles
+                self.rows = _rows_after_put(self.rows, indices)
+            return ('take', indices)
+        old_tokens = channels.tokens(indices)
+        channels.set_tokens(indices, tokens)
+        if self.keys is not None:
+            for i in indices:
+                self.keys[i] = self.key(channels[i])
+        if self.columns:
+            changed = [channels[i] for i in indices]
+            for field, column in self.columns.items():
+                for i, value in zip(indices, self.column(changed, field)):
+                    column[i] = value
+        if self.rows is not None:
+            # Al deshacer pueden cambiar canales ocultos: también se ven
+            self.rows = array('q', sorted(set(self.rows).union(indices)))
+        return ('set', indices, old_tokens)
+
+
+def _rows_after_take(rows, indices):
+    """Filas visibles tras quitar de channels los índices (crecientes) indices"""
+    result = array('q')
+    removed = 0
+    for row in rows:
+        while removed < len(indices) and indices[removed] < row:
+            removed += 1
+        if removed < len(indices) and indices[removed] == row:
+            continue
+        result.append(row - removed)
+    return result
+
+
+def _rows_after_put(rows, indices):
+    """
+    Filas visibles tras insertar en channels canales que quedan en los
+    índices (crecientes) indices; los insertados también se ven.
+    """
+    shifted = array('q')
+    added = 0
+    for row in rows:
+        while added < len(indices) and indices[added] <= row + added:
+            added += 1
+        shifted.append(row + added)
+    return array('q', heapq.merge(shifted, indices))
@@ -0,0 +1,225 @@
+import gzip
+import io
+import lzma
+import os
+import urllib.request
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Firmas de los formatos comprimidos admitidos, por sus primeros bytes
+MAGIC = (
+    (b'\x1f\x8b', 'gz'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zst'),
+)
+
+# Extensiones del archivo de salida que activan la compresión
+EXTENSIONS = {
+    '.gz': 'gz',
+    '.xz': 'xz',
+    '.zst': 'zst',
+    '.zstd': 'zst',
+}
+
+# Extensiones de las listas que se pueden abrir (también comprimidas)
+OPEN_EXTENSIONS = ('.m3u', '.m3u8', '.gz', '.xz', '.zst')
+
+# Tipos de archivo para los diálogos de abrir y guardar
+OPEN_FILETYPES = [("Archivos M3U/M3U8", ' '.join('*' + ext for ext in OPEN_EXTENSIONS)),
+                  ("Todos los archivos", "*")]
+SAVE_FILETYPES = [
+    ("Archivos M3U", "*.m3u"),
+    ("M3U comprimido (gzip)", "*.m3u.gz"),
+    ("M3U comprimido (xz)", "*.m3u.xz"),
+    ("M3U comprimido (zstd)", "*.m3u.zst"),
+]
+
+# Tamaño del búfer de lectura sobre el flujo descomprimido
+READ_BUFFER = 1024 * 1024
+
+# Esquemas que se tratan como listas remotas en lugar de rutas locales
+URL_SCHEMES = ('http://', 'https://', 'ftp://')
+
+# Cabeceras de las peticiones de listas remotas: se pide la transferencia
+# comprimida y se descomprime al leer
+REQUEST_HEADERS = {'User-Agent': 'kidneysm3u', 'Accept-Encoding': 'gzip'}
+
+
+def is_url(text):
+    """Indica si la entrada es una URL en lugar de una ruta local"""
+    return text.lower().startswith(URL_SCHEMES)
+
+
+def is_playlist_file(path):
+    """Indica si la ruta tiene una de las extensiones de OPEN_EXTENSIONS, como los diálogos de abrir"""
+    return path.lower().endswith(OPEN_EXTENSIONS)
+
+
+def detect_compression(path):
+    """Devuelve 'gz', 'xz' o 'zst' según los primeros bytes del archivo, o None"""
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    return _detect(head)
+
+
+def _detect(head):
+    for magic, kind in MAGIC:
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def output_compression(path):
+    """Formato de compresión que corresponde a la extensión del archivo de salida"""
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ValueError("Para leer o escribir archivos .zst hay que instalar el paquete 'zstandard'")
+
+
+class _Decompressed(io.RawIOBase):
+    """
+    Flujo de lectura sobre un archivo comprimido. Cierra también el archivo
+    de origen y permite consultar cuántos bytes comprimidos se han leído,
+    que es lo que se usa para calcular el progreso.
+    """
+
+    def __init__(self, source, stream):
+        self.source = source
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self.stream.readinto(b)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.stream.close()
+            finally:
+                self.source.close()
+        super().close()
+
+
+class _Counting(io.RawIOBase):
+    """Flujo de lectura que cuenta los bytes recibidos de una respuesta HTTP"""
+
+    def __init__(self, response):
+        self.response = response
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.response.readinto(b)
+        self.count += n or 0
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.response.close()
+        super().close()
+
+
+def _decompress(source):
+    """
+    Devuelve source tal cual o envuelto en un descompresor si sus primeros
+    bytes son los de gzip, xz o zstd. Si falla, cierra source.
+    """
+    try:
+        kind = _detect(source.peek(6)[:6])
+        if kind is None:
+            return source
+        if kind == 'gz':
+            stream = gzip.GzipFile(fileobj=source, mode='rb')
+        elif kind == 'xz':
+            stream = lzma.LZMAFile(source, 'rb')
+        else:
+            _require_zstandard()
+            stream = zstandard.ZstdDecompressor().stream_reader(source, read_across_frames=True,
+                                                                 closefd=False)
+    except Exception:
+        source.close()
+        raise
+    return io.BufferedReader(_Decompressed(source, stream), READ_BUFFER)
+
+
+def open_binary(path):
+    """
+    Abre un archivo M3U para lectura binaria. Si está comprimido con gzip,
+    xz o zstd (se detecta por los primeros bytes, no por la extensión) se
+    descomprime al vuelo sin cargarlo entero en memoria.
+    """
+    return _decompress(open(path, 'rb'))
+
+
+def open_url(url, timeout=60):
+    """
+    Abre una lista remota como flujo binario, descomprimiéndola al vuelo
+    igual que open_binary. Devuelve (flujo, tamaño) donde tamaño es el
+    Content-Length de la respuesta (bytes transferidos) o 0 si el servidor
+    no lo indica. Nada se guarda en disco.
+    """
+    request = urllib.request.Request(url, headers=REQUEST_HEADERS)
+    return open_response(urllib.request.urlopen(request, timeout=timeout))
+
+
+def open_response(response, raw=None):
+    """
+    Igual que open_url pero a partir de una respuesta HTTP ya recibida.
+    raw es el flujo del que leer en lugar de la respuesta (por ejemplo uno
+    que guarde una copia de lo recibido); el tamaño sale de las cabeceras.
+    """
+    try:
+        length = int(response.headers.get('Content-Length') or 0)
+    except ValueError:
+        length = 0
+    return _decompress(io.BufferedReader(_Counting(raw or response), READ_BUFFER)), length
+
+
+def open_text(path, errors='strict'):
+    """Igual que open_binary pero devuelve las líneas como texto UTF-8"""
+    return io.TextIOWrapper(open_binary(path), encoding='utf-8', errors=errors)
+
+
+def read_position(stream):
+    """
+    Bytes del origen ya consumidos por un flujo de open_binary u open_url
+    (comprimidos si el origen lo está), para calcular el progreso.
+    """
+    raw = getattr(stream, 'raw', None)
+    if isinstance(raw, _Decompressed):
+        return read_position(raw.source)
+    if isinstance(raw, _Counting):
+        return raw.count
+    return stream.tell()
+
+
+def open_output(path, mode='w'):
+    """
+    Abre el archivo de salida en binario ('w' o 'a'), comprimido según su
+    extensión (.gz, .xz o .zst). Añadir a un archivo comprimido crea un nuevo
+    miembro o trama al final, que los tres formatos leen como continuación.
+    """
+    kind = output_compression(path)
+    if kind == 'gz':
+        return gzip.open(path, mode + 'b', compresslevel=6)
+    if kind == 'xz':
+        return lzma.open(path, mode + 'b', preset=3)
+    if kind == 'zst':
+        _require_zstandard()
+        return zstandard.ZstdCompressor(level=3).stream_writer(open(path, mode + 'b'))
+    return open(path, mode + 'b')
+
+
+def open_output_text(path, mode='w'):
+    """Igual que open_output pero para escribir texto UTF-8"""
+    return io.TextIOWrapper(open_output(path, mode), encoding='utf-8')
@@ -0,0 +1,269 @@
+import io
+import re
+import unicodedata
+from collections import namedtuple
+import m3u_io
+
+# Campos de #EXTINF que se pueden usar en los filtros y búsquedas
+FIELDS = ('tvg-id', 'tvg-name', 'tvg-logo', 'group-title', 'tvg-chno', 'duration', 'name')
+
+# Nombres cortos admitidos para los campos
+FIELD_ALIASES = {
+    'id': 'tvg-id',
+    'logo': 'tvg-logo',
+    'group': 'group-title',
+    'grupo': 'group-title',
+    'chno': 'tvg-chno',
+    'nombre': 'name',
+}
+
+
+_NON_WORD_RE = re.compile(r'[\W_]+')
+_NON_WORD_LINES_RE = re.compile(r'[^\w\n]+')
+_LINE_EDGE_SPACES_RE = re.compile(r' ?\n ?')
+# Signos ASCII (todo lo que no es letra, número o salto de línea) -> espacio
+_ASCII_NON_WORD = str.maketrans({chr(c): ' ' for c in range(128) if not chr(c).isalnum() and c != 10})
+
+
+class ExtInf(namedtuple('ExtInf', ['duration', 'attrs', 'name'])):
+    """Campos de una línea #EXTINF: duración, atributos y nombre visible"""
+    __slots__ = ()
+
+    def get(self, field, default=''):
+        """Devuelve el valor de un campo por su nombre o alias"""
+        field = FIELD_ALIASES.get(field, field)
+        if field == 'name':
+            return self.name
+        if field == 'duration':
+            return self.duration
+        return self.attrs.get(field, default)
+
+
+def normalize_field(field):
+    """Devuelve el nombre canónico del campo o None si no es un campo conocido"""
+    field = field.lower()
+    field = FIELD_ALIASES.get(field, field)
+    return field if field in FIELDS else None
+
+
+def _name_comma(line):
+    """
+    Posición de la coma que separa la cabecera del nombre: la primera con un
+    número par de comillas delante. Devuelve -1 si no hay coma.
+    """
+    start = 8 if line.startswith('#EXTINF:') else 0
+    comma = line.find(',', start)
+    while comma >= 0 and line.count('"', start, comma) % 2:
+        comma = line.find(',', comma + 1)
+    if comma < 0:
+        # Comillas sin cerrar: usar la primera coma
+        comma = line.find(',', start)
+    return comma
+
+
+def extinf_name(line):
+    """Devuelve solo el nombre visible de una línea #EXTINF"""
+    comma = _name_comma(line)
+    return line[comma + 1:].strip() if comma >= 0 else ''
+
+
+def parse_extinf(line):
+    """
+    Analiza una línea #EXTINF y devuelve un ExtInf con la duración, los
+    atributos (con las claves en minúsculas) y el nombre visible. El nombre
+    es lo que sigue a la primera coma fuera de comillas, de modo que las
+    comas dentro de tvg-name o group-title no lo cortan.
+    """
+    comma = _name_comma(line)
+    start = 8 if line.startswith('#EXTINF:') else 0
+    if comma < 0:
+        header, name = line[start:], ''
+    else:
+        header, name = line[start:comma], line[comma + 1:]
+    header = header.strip()
+    duration, _, rest = header.partition(' ')
+    if '=' in duration:
+        # Sin duración: la cabecera empieza directamente por los atributos
+        duration, rest = '', header
+    attrs = {}
+    if '=' in rest:
+        # Tras dividir por comillas quedan alternos 'clave=' y valor
+        parts = rest.split('"')
+        for key, value in zip(parts[0::2], parts[1::2]):
+            key = key.rstrip()
+            if key.endswith('='):
+                key = key[:-1].strip()
+                if ' ' in key:
+                    key = key.split()[-1]
+                attrs[key.lower()] = value
+    return ExtInf(duration, attrs, name.strip())
+
+
+def extinf_field(line, field):
+    """
+    Devuelve el valor de un único campo de una línea #EXTINF sin analizar
+    el resto de atributos. Es la vía rápida de los filtros campo:valor; los
+    casos raros (claves con otra capitalización) se resuelven con
+    parse_extinf.
+    """
+    field = FIELD_ALIASES.get(field, field)
+    if field == 'name':
+        return extinf_name(line)
+    if field == 'duration':
+        return parse_extinf(line).duration
+    key = f' {field}="'
+    i = line.find(key)
+    if i >= 0 and line.count('"', 0, i) % 2 == 0:
+        comma = _name_comma(line)
+        if comma < 0 or i < comma:
+            start = i + len(key)
+            end = line.find('"', start)
+            if end >= 0:
+                return line[start:end]
+    if key not in line.lower():
+        return ''
+    return parse_extinf(line).attrs.get(field, '')
+
+
+def extinf_field_span(line, field):
+    """
+    Posición (inicio, fin) en line del valor de un atributo de #EXTINF, o
+    None si no lo tiene. Es el mismo valor que devuelve extinf_field (fuera
+    de comillas, antes del nombre y sin distinguir mayúsculas en la clave),
+    para poder sustituirlo sin tocar el resto de la línea.
+    """
+    field = FIELD_ALIASES.get(field, field)
+    comma = _name_comma(line)
+    header = line if comma < 0 else line[:comma]
+    lowered = header.lower()
+    key = f'{field}="'
+    i = lowered.find(key)
+    while i >= 0:
+        if i > 0 and lowered[i - 1] in ' \t:' and lowered.count('"', 0, i) % 2 == 0:
+            start = i + len(key)
+            end = header.find('"', start)
+            return (start, end) if end >= 0 else None
+        i = lowered.find(key, i + 1)
+    return None
+
+
+def extinf_name_span(line):
+    """Posición (inicio, fin) en line del nombre visible, o None si no hay coma"""
+    comma = _name_comma(line)
+    if comma < 0:
+        return None
+    end = len(line.rstrip())
+    start = comma + 1
+    while start < end and line[start].isspace():
+        start += 1
+    return start, end
+
+
+def normalize_text(text):
+    """
+    Normaliza un nombre para comparaciones: minúsculas sin acentos y con los
+    espacios y signos de puntuación reducidos a un solo espacio
+    ("La 1  HD" y "la-1 hd" dan "la 1 hd").
+    """
+    text = unicodedata.normalize('NFKD', text.casefold())
+    if not text.isascii():
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return _NON_WORD_RE.sub(' ', text).strip()
+
+
+def normalize_lines(text):
+    """
+    normalize_text aplicado a cada línea de text, conservando los saltos de
+    línea. Con miles de nombres unidos por saltos de línea es varias veces
+    más rápido que normalizarlos uno a uno, porque cada paso se hace sobre
+    todo el texto de una vez.
+    """
+    text = text.casefold()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        # Solo se buscan los signos diacríticos que aparecen en el texto
+        # (suelen ser muy pocos, y str.replace es mucho más rápido que una
+        # expresión regular sobre varios MB)
+        for mark in [ch for ch in set(text) if unicodedata.combining(ch)]:
+            text = text.replace(mark, '')
+    if text.isascii():
+        # Lo habitual tras quitar los acentos: str.translate y str.replace
+        # son unas diez veces más rápidos que las expresiones regulares
+        text = text.translate(_ASCII_NON_WORD)
+        while '  ' in text:
+            text = text.replace('  ', ' ')
+        return text.replace(' \n', '\n').replace('\n ', '\n').strip(' ')
+    text = _NON_WORD_LINES_RE.sub(' ', text.replace('_', ' '))
+    return _LINE_EDGE_SPACES_RE.sub('\n', text).strip(' ')
+
+
+class M3UEntry(namedtuple('M3UEntry', ['extinf', 'url', 'lines'])):
+    """
+    Entrada de una lista M3U tal como aparece en el archivo: la línea
+    #EXTINF, la línea de la URL y todas las líneas del bloque (cabecera,
+    opciones como #EXTVLCOPT, URL y lo que haya hasta el siguiente #EXTINF),
+    sin quitar los saltos de línea. Son str o bytes según la fuente.
+    """
+    __slots__ = ()
+
+    def text(self):
+        """Devuelve (extinf, url) como texto sin espacios ni saltos de línea"""
+        extinf, url = self.extinf, self.url
+        if isinstance(extinf, bytes):
+            extinf = extinf.decode('utf-8', errors='replace')
+            url = url.decode('utf-8', errors='replace')
+        return extinf.strip(), url.strip()
+
+
+def iter_entries(lines):
+    """
+    Genera un M3UEntry por cada bloque #EXTINF de un iterable de líneas (str
+    o bytes), sin leer más que el bloque en curso. La URL es la primera
+    línea no vacía que no empieza por '#'; los bloques sin URL se descartan.
+    Cada entrada se entrega al llegar el siguiente #EXTINF o el final, para
+    que el bloque incluya todas sus líneas.
+    """
+    marker = prefix = None
+    block = url = None
+    for line in lines:
+        if marker is None:
+            if isinstance(line, bytes):
+                marker, prefix = b'#EXTINF', b'#'
+            else:
+                marker, prefix = '#EXTINF', '#'
+        if line.startswith(marker):
+            if url is not None:
+                yield M3UEntry(block[0], url, block)
+            block = [line]
+            url = None
+        elif block is not None:
+            block.append(line)
+            if url is None and not line.startswith(prefix) and line.strip():
+                url = line
+    if url is not None:
+        yield M3UEntry(block[0], url, block)
+
+
+def read_entries(source, text=True):
+    """
+    Genera las entradas de una lista M3U a partir de una ruta local, una URL
+    o un flujo ya abierto (un archivo o una respuesta HTTP), descomprimiendo
+    gzip, xz o zstd al vuelo (ver m3u_io). Con text=True las líneas son str
+    y, si no, bytes. La memoria usada no depende del tamaño de la lista.
+    """
+    opened = isinstance(source, str)
+    if opened:
+        stream = m3u_io.open_url(source)[0] if m3u_io.is_url(source) else m3u_io.open_binary(source)
+    else:
+        stream = source
+    wrapper = None
+    try:
+        if text and not isinstance(stream, io.TextIOBase):
+            stream = wrapper = io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
+        yield from iter_entries(stream)
+    finally:
+        if opened:
+            stream.close()
+        elif wrapper is not None:
+            # El flujo es del llamador: no se cierra
+            wrapper.detach()
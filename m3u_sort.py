@@ -0,0 +1,78 @@
+import math
+import re
+from m3u_dedup import url_host
+from m3u_parser import extinf_field, extinf_name, normalize_lines
+
+# Criterios de ordenación de M3USorter: clave y texto que se muestra
+SORT_KEYS = (
+    ('name', 'Nombre'),
+    ('group', 'Grupo (group-title)'),
+    ('chno', 'Número de canal (tvg-chno)'),
+    ('id', 'tvg-id'),
+    ('host', 'Servidor de la URL'),
+)
+
+_DIGITS_RE = re.compile(r'(\d+)')
+
+
+def channel_url(body):
+    """URL de un canal: la última línea de su cuerpo que no es un comentario"""
+    for line in reversed(body.splitlines()):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            return line
+    return ''
+
+
+def _pad_number(match):
+    return match.group().zfill(12)
+
+
+def natural_keys(names):
+    """
+    Claves de orden natural de una lista de nombres, sin tener en cuenta
+    mayúsculas, acentos ni signos (m3u_parser.normalize_lines): los números
+    se rellenan con ceros, así que "Canal 2" va antes que "Canal 10" y
+    "Ñandú" junto a "Nandu". Son textos, que se comparan deprisa.
+    """
+    if not names:
+        return []
+    folded = normalize_lines('\n'.join(name.replace('\n', ' ') for name in names))
+    return _DIGITS_RE.sub(_pad_number, folded).split('\n')
+
+
+def _missing_last(values):
+    # Los canales sin el dato van al final
+    return [('0' + value) if value else '1' for value in values]
+
+
+def _chno_key(value):
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        number = math.nan
+    if math.isfinite(number):
+        return (0, number, '')
+    return (1 if value else 2, 0.0, value.casefold())
+
+
+def sort_column(channels, field):
+    """
+    Clave de un criterio de SORT_KEYS para cada canal (extinf, cuerpo) de
+    channels, calculadas todas de una vez (los nombres se normalizan todos
+    juntos). FilteredChannels las guarda y ordena por varios criterios
+    comparando tuplas de estas claves.
+    """
+    if field == 'name':
+        return natural_keys([extinf_name(extinf) for extinf, _ in channels])
+    if field == 'group':
+        groups = [extinf_field(extinf, 'group-title') for extinf, _ in channels]
+        return _missing_last(natural_keys(groups))
+    if field == 'chno':
+        return [_chno_key(extinf_field(extinf, 'tvg-chno')) for extinf, _ in channels]
+    if field == 'id':
+        return _missing_last([extinf_field(extinf, 'tvg-id').casefold() for extinf, _ in channels])
+    if field == 'host':
+        return _missing_last([url_host(channel_url(body)) for _, body in channels])
+    raise ValueError(f"Criterio de ordenación no válido: {field}")
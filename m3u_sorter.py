@@ -1,6 +1,14 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
+import os
 import re
+from m3u_parser import extinf_name, read_entries
+import m3u_io
+from m3u_dedup import find_duplicates
+from m3u_index import ChannelList, FilteredChannels, IndexedChannels, M3UIndex
+from m3u_sort import SORT_KEYS, channel_url, sort_column
+from m3u_transform import TRANSFORM_FIELDS, Replacement, replace_channels
+from virtual_list import VirtualListbox
 
 class M3USorter:
     def __init__(self, root, input_file):
@@ -9,13 +17,20 @@ class M3USorter:
         self.window.geometry('800x600')
         
         self.input_file = input_file
-        self.channels = []
+        # Lista de pares (extinf, cuerpo); con archivos sin comprimir es una
+        # IndexedChannels que lee cada entrada del archivo al mostrarla
+        self.channels = ChannelList()
+        # Filas de la lista: todos los canales o los que cumplen la búsqueda
+        self.view = FilteredChannels(self.channels, self.channel_key, sort_column)
+        self.index = None
         self.clipboard = []
         self.last_selection = None
         self.drag_start_index = None
+        self.drag_moved = False
         
         self.create_widgets()
         self.load_channels()
+        self.window.bind('<Destroy>', self.on_destroy)
         
     def create_widgets(self):
         main_frame = ttk.Frame(self.window, padding='10')
@@ -35,8 +50,11 @@ class M3USorter:
         list_frame = ttk.Frame(main_frame)
         list_frame.pack(fill=tk.BOTH, expand=True, pady=5)
         
-        # Lista de canales
-        self.channels_listbox = tk.Listbox(list_frame, selectmode=tk.EXTENDED)
+        # Lista de canales (virtual: solo se dibujan las filas visibles). Sus
+        # elementos son las filas de self.view, que es quien aplica las
+        # ediciones a self.channels aunque la lista esté filtrada
+        self.channels_listbox = VirtualListbox(list_frame, selectmode=tk.EXTENDED,
+                                               label=lambda channel: self.get_channel_name(channel[0]))
         self.channels_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         
         # Scrollbar para la lista
@@ -56,6 +74,11 @@ class M3USorter:
         ttk.Button(buttons_frame, text='Eliminar (Del)', command=self.delete_channels).pack(side=tk.LEFT, padx=5)
         ttk.Button(buttons_frame, text='Editar Canal', command=self.edit_channel).pack(side=tk.LEFT, padx=5)
         ttk.Button(buttons_frame, text='Cambiar Grupo', command=self.change_group).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text='Ordenar...', command=self.sort_dialog).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text='Reemplazar...', command=self.replace_dialog).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text='Buscar duplicados...', command=self.duplicates_dialog).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text='Deshacer (Ctrl+Z)', command=self.undo).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text='Rehacer (Ctrl+Y)', command=self.redo).pack(side=tk.LEFT, padx=5)
         ttk.Checkbutton(buttons_frame, text='Activar Drag & Drop', variable=self.drag_enabled, 
                        command=self.toggle_drag_drop).pack(side=tk.LEFT, padx=5)
         ttk.Button(buttons_frame, text='Guardar', command=self.save_channels).pack(side=tk.RIGHT, padx=5)
@@ -65,6 +88,8 @@ class M3USorter:
         self.window.bind('<Control-v>', lambda e: self.paste_channels())
         self.window.bind('<Delete>', lambda e: self.delete_channels())
         self.window.bind('<Control-a>', lambda e: self.select_all())
+        self.window.bind('<Control-z>', lambda e: self.undo())
+        self.window.bind('<Control-y>', lambda e: self.redo())
 
     def select_all(self, event=None):
         self.channels_listbox.select_set(0, tk.END)
@@ -74,66 +99,89 @@ class M3USorter:
         selected_indices = self.channels_listbox.curselection()
         if not selected_indices:
             return
-        self.clipboard = [(self.channels[i], self.channels_listbox.get(i)) for i in selected_indices]
+        self.clipboard = [(self.view[i], self.channels_listbox.get(i)) for i in selected_indices]
 
     def paste_channels(self):
         if not self.clipboard:
             return
             
         current_selection = self.channels_listbox.curselection()
-        insert_index = current_selection[0] if current_selection else tk.END
-        
-        for channel, name in self.clipboard:
-            if insert_index == tk.END:
-                self.channels.append(channel)
-                self.channels_listbox.insert(tk.END, name)
-            else:
-                self.channels.insert(insert_index, channel)
-                self.channels_listbox.insert(insert_index, name)
-                insert_index += 1
+        insert_index = current_selection[0] if current_selection else len(self.view)
+        rows = self.view.insert(insert_index, [channel for channel, name in self.clipboard])
+        self.show_edit(rows)
 
     def delete_channels(self, event=None):
         selected_indices = self.channels_listbox.curselection()
         if not selected_indices:
             return
-            
-        for i in reversed(selected_indices):
-            self.channels.pop(i)
-            self.channels_listbox.delete(i)
+        self.view.delete(selected_indices)
+        self.show_edit()
+
+    def show_edit(self, rows=None):
+        """
+        Vuelve a dibujar la lista una sola vez tras una edición por lotes y
+        selecciona las filas rows (un range); sin rows se deja la selección
+        si no ha cambiado el número de filas.
+        """
+        self.channels_listbox.refresh()
+        if rows is not None:
+            self.channels_listbox.selection_clear(0, tk.END)
+            if rows:
+                self.channels_listbox.selection_set(rows[0], rows[-1])
+                self.channels_listbox.see(rows[0])
+
+    def undo(self, event=None):
+        if self.view.undo():
+            self.show_edit(range(0))
+        return 'break'
+
+    def redo(self, event=None):
+        if self.view.redo():
+            self.show_edit(range(0))
+        return 'break'
 
     def load_channels(self):
         try:
-            with open(self.input_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                
-            i = 0
-            while i < len(lines):
-                if lines[i].startswith('#EXTINF:'):
-                    if i + 1 < len(lines):
-                        self.channels.append((lines[i], lines[i + 1]))
-                        self.channels_listbox.insert(tk.END, self.get_channel_name(lines[i]))
-                        i += 2
-                    else:
-                        i += 1
-                else:
-                    i += 1
+            # La segunda parte del canal es el resto del bloque (opciones como
+            # #EXTVLCOPT y la URL) para no perderlo al guardar.
+            if M3UIndex.supports(self.input_file):
+                # Solo se guarda la posición de cada entrada; el texto se lee
+                # del archivo al mostrarla, editarla o guardarla
+                self.index = M3UIndex(self.input_file)
+                self.channels = IndexedChannels(self.index)
+            else:
+                # Archivo comprimido: se lee entrada a entrada a memoria
+                for entry in read_entries(self.input_file):
+                    body = ''.join(entry.lines[1:]).strip('\n') + '\n'
+                    self.channels.append((entry.extinf if entry.extinf.endswith('\n') else entry.extinf + '\n', body))
+            self.view = FilteredChannels(self.channels, self.channel_key, sort_column)
+            self.channels_listbox.set_items(self.view)
                     
         except Exception as e:
             messagebox.showerror('Error', f'Error al cargar el archivo: {str(e)}')
+
+    def on_destroy(self, event):
+        if event.widget is self.window and self.index is not None:
+            self.index.close()
+            self.index = None
     
     def get_channel_name(self, extinf_line):
         try:
-            return extinf_line.split(',')[-1].strip()
+            return extinf_name(extinf_line)
         except:
             return 'Canal sin nombre'
 
+    def channel_key(self, channel):
+        """Texto del canal con el que se compara la búsqueda"""
+        return self.get_channel_name(channel[0]).lower()
+
     def edit_channel(self):
         selection = self.channels_listbox.curselection()
         if not selection:
             return
             
         index = selection[0]
-        extinf_line, url_line = self.channels[index]
+        extinf_line, url_line = self.view[index]
         
         edit_window = tk.Toplevel(self.window)
         edit_window.title('Editar Canal')
@@ -141,20 +189,19 @@ class M3USorter:
         
         ttk.Label(edit_window, text='Información del canal:').pack(pady=5)
         info_text = tk.Text(edit_window, height=5)
-        info_text.insert('1.0', extinf_line)
+        info_text.insert('1.0', extinf_line.rstrip('\n'))
         info_text.pack(fill=tk.X, padx=5, pady=5)
         
         ttk.Label(edit_window, text='URL:').pack(pady=5)
         url_text = tk.Text(edit_window, height=2)
-        url_text.insert('1.0', url_line)
+        url_text.insert('1.0', url_line.rstrip('\n'))
         url_text.pack(fill=tk.X, padx=5, pady=5)
         
         def save_changes():
             new_extinf = info_text.get('1.0', 'end-1c')
             new_url = url_text.get('1.0', 'end-1c')
-            self.channels[index] = (new_extinf + '\n', new_url + '\n')
-            self.channels_listbox.delete(index)
-            self.channels_listbox.insert(index, self.get_channel_name(new_extinf))
+            self.view.replace([index], [(new_extinf + '\n', new_url + '\n')])
+            self.show_edit()
             edit_window.destroy()
             
         ttk.Button(edit_window, text='Guardar', command=save_changes).pack(pady=10)
@@ -162,17 +209,28 @@ class M3USorter:
     def save_channels(self):
         output_file = filedialog.asksaveasfilename(
             defaultextension='.m3u',
-            filetypes=[('Archivos M3U', '*.m3u')],
+            filetypes=m3u_io.SAVE_FILETYPES,
             initialfile='lista_ordenada.m3u'
         )
         
         if output_file:
             try:
-                with open(output_file, 'w', encoding='utf-8') as f:
+                # Si se guarda sobre el archivo de entrada, se escribe aparte
+                # y se sustituye al final: las entradas se siguen leyendo de él
+                target = output_file
+                if os.path.exists(output_file) and os.path.samefile(output_file, self.input_file):
+                    base, ext = os.path.splitext(output_file)
+                    target = base + '.tmp' + ext
+                with m3u_io.open_output_text(target) as f:
                     f.write('#EXTM3U\n')
                     for extinf_line, url_line in self.channels:
                         f.write(extinf_line)
                         f.write(url_line)
+                if target != output_file:
+                    if self.index is not None:
+                        self.index.close()
+                        self.index = None
+                    os.replace(target, output_file)
                 messagebox.showinfo('Éxito', 'Lista guardada correctamente')
                 self.window.destroy()
             except Exception as e:
@@ -190,33 +248,29 @@ class M3USorter:
             
     def on_click(self, event):
         self.drag_start_index = self.channels_listbox.nearest(event.y)
+        self.drag_moved = False
         
     def on_drag(self, event):
         drag_index = self.channels_listbox.nearest(event.y)
         if drag_index != self.drag_start_index:
-            self.move_channels(self.drag_start_index, drag_index)
+            # Todos los pasos de un arrastre se deshacen de una vez
+            self.move_channels(self.drag_start_index, drag_index, merge=self.drag_moved)
             self.drag_start_index = drag_index
+            self.drag_moved = True
 
     def on_drop(self, event):
         pass  
 
-    def move_channels(self, from_index, to_index):
+    def move_channels(self, from_index, to_index, merge=False):
         selected_indices = self.channels_listbox.curselection()
         if not selected_indices:
             selected_indices = [from_index]
             
-        selected_channels = [self.channels[i] for i in selected_indices]
-        selected_names = [self.channels_listbox.get(i) for i in selected_indices]
-        
-        for i in reversed(selected_indices):
-            self.channels.pop(i)
-            self.channels_listbox.delete(i)
-        
-        for i, (channel, name) in enumerate(zip(selected_channels, selected_names)):
-            insert_pos = to_index if to_index < from_index else to_index - len(selected_indices) + 1
-            self.channels.insert(insert_pos + i, channel)
-            self.channels_listbox.insert(insert_pos + i, name)
-            self.channels_listbox.selection_set(insert_pos + i)
+        # Se quitan y se insertan todas las filas de una vez
+        insert_pos = to_index if to_index < from_index else to_index - len(selected_indices) + 1
+        insert_pos = max(0, min(insert_pos, len(self.view) - len(selected_indices)))
+        rows = self.view.move(selected_indices, insert_pos, merge)
+        self.show_edit(rows)
 
     def cut_channels(self):
         self.copy_channels()
@@ -229,8 +283,9 @@ class M3USorter:
             
         new_group = simpledialog.askstring("Cambiar Grupo", "Ingrese el nuevo grupo:")
         if new_group:
+            updated = []
             for i in selected_indices:
-                extinf_line, url = self.channels[i]
+                extinf_line, url = self.view[i]
                 updated_line = re.sub(
                     r'(group-title=")[^"]*(")',
                     f'\\1{new_group}\\2',
@@ -240,15 +295,202 @@ class M3USorter:
                 if 'group-title=' not in updated_line:
                     updated_line = extinf_line.replace('#EXTINF:', f'#EXTINF: group-title="{new_group}",', 1)
                 
-                self.channels[i] = (updated_line, url)
-                self.channels_listbox.delete(i)
-                self.channels_listbox.insert(i, self.get_channel_name(updated_line))
+                updated.append((updated_line, url))
+            self.view.replace(selected_indices, updated)
+            self.show_edit()
+
+    def sort_dialog(self):
+        """Pide hasta tres criterios de ordenación y ordena la lista"""
+        dialog = tk.Toplevel(self.window)
+        dialog.title('Ordenar canales')
+        dialog.transient(self.window)
+        labels = [label for _, label in SORT_KEYS]
+        choices = []
+        for i, text in enumerate(('Ordenar por:', 'Después por:', 'Después por:')):
+            ttk.Label(dialog, text=text).grid(row=i, column=0, sticky=tk.W, padx=5, pady=5)
+            choice = ttk.Combobox(dialog, values=labels if i == 0 else ['(ninguno)'] + labels,
+                                  state='readonly', width=30)
+            choice.current(0)
+            choice.grid(row=i, column=1, padx=5, pady=5)
+            choices.append(choice)
+        ttk.Label(dialog, text='Con una búsqueda escrita se ordenan solo los canales encontrados.').grid(
+            row=3, column=0, columnspan=2, padx=5, pady=5)
+
+        def apply():
+            fields = []
+            for choice in choices:
+                label = choice.get()
+                for field, field_label in SORT_KEYS:
+                    if label == field_label and field not in fields:
+                        fields.append(field)
+            dialog.destroy()
+            self.sort_channels(fields)
+
+        ttk.Button(dialog, text='Ordenar', command=apply).grid(row=4, column=0, columnspan=2, pady=10)
+
+    def sort_channels(self, fields):
+        """Ordena las filas visibles por los criterios fields (claves de SORT_KEYS)"""
+        try:
+            self.window.config(cursor='watch')
+            self.window.update_idletasks()
+            if self.view.sort(fields):
+                self.show_edit(range(0))
+        except Exception as e:
+            messagebox.showerror('Error', f'Error al ordenar: {str(e)}')
+        finally:
+            self.window.config(cursor='')
+
+    def replace_dialog(self):
+        """Buscar y reemplazar en un campo de toda la lista o de la selección"""
+        dialog = tk.Toplevel(self.window)
+        dialog.title('Reemplazar')
+        dialog.transient(self.window)
+        labels = [label for _, label in TRANSFORM_FIELDS]
+        ttk.Label(dialog, text='Campo:').grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
+        field_choice = ttk.Combobox(dialog, values=labels, state='readonly', width=30)
+        field_choice.current(0)
+        field_choice.grid(row=0, column=1, sticky=tk.W, padx=5, pady=5)
+        find_var = tk.StringVar()
+        replace_var = tk.StringVar()
+        ttk.Label(dialog, text='Buscar:').grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        ttk.Entry(dialog, textvariable=find_var, width=40).grid(row=1, column=1, padx=5, pady=5)
+        ttk.Label(dialog, text='Reemplazar por:').grid(row=2, column=0, sticky=tk.W, padx=5, pady=5)
+        ttk.Entry(dialog, textvariable=replace_var, width=40).grid(row=2, column=1, padx=5, pady=5)
+        regex_var = tk.BooleanVar(value=False)
+        ignore_case_var = tk.BooleanVar(value=False)
+        selection_var = tk.BooleanVar(value=bool(self.channels_listbox.curselection()))
+        ttk.Checkbutton(dialog, text='Expresión regular', variable=regex_var).grid(
+            row=3, column=1, sticky=tk.W, padx=5)
+        ttk.Checkbutton(dialog, text='No distinguir mayúsculas', variable=ignore_case_var).grid(
+            row=4, column=1, sticky=tk.W, padx=5)
+        ttk.Checkbutton(dialog, text='Solo en los canales seleccionados', variable=selection_var).grid(
+            row=5, column=1, sticky=tk.W, padx=5)
+        preview = ttk.Label(dialog, text='')
+        preview.grid(row=6, column=0, columnspan=2, padx=5, pady=5)
+
+        def changes():
+            field = TRANSFORM_FIELDS[labels.index(field_choice.get())][0]
+            replacement = Replacement(field, find_var.get(), replace_var.get(),
+                                      regex_var.get(), ignore_case_var.get())
+            if selection_var.get():
+                positions = self.channels_listbox.curselection()
+            else:
+                positions = range(len(self.view))
+            changed_positions, channels = replace_channels([self.view[i] for i in positions], [replacement])
+            return [positions[i] for i in changed_positions], channels
+
+        def count():
+            try:
+                positions, _ = changes()
+            except ValueError as e:
+                preview.config(text=str(e))
+                return
+            preview.config(text=f'Se modificarán {len(positions)} canales')
+
+        def apply():
+            try:
+                positions, channels = changes()
+            except ValueError as e:
+                messagebox.showerror('Error', str(e), parent=dialog)
+                return
+            if positions:
+                # Todos los cambios son una sola edición (se deshace de una vez)
+                self.view.replace(positions, channels)
+                self.show_edit()
+            dialog.destroy()
+            messagebox.showinfo('Reemplazar', f'Canales modificados: {len(positions)}', parent=self.window)
+
+        buttons = ttk.Frame(dialog)
+        buttons.grid(row=7, column=0, columnspan=2, pady=10)
+        ttk.Button(buttons, text='Contar', command=count).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text='Reemplazar', command=apply).pack(side=tk.LEFT, padx=5)
+
+    def duplicates_dialog(self):
+        """
+        Busca canales repetidos entre las filas visibles (misma URL y, si se
+        pide, nombres parecidos) y los muestra agrupados para seleccionarlos
+        o eliminar de una vez todos menos el primero de cada grupo.
+        """
+        dialog = tk.Toplevel(self.window)
+        dialog.title('Buscar duplicados')
+        dialog.transient(self.window)
+        # Modal: groups guarda posiciones de self.view, que dejarían de valer
+        # si se edita, filtra u ordena la lista con el diálogo abierto
+        dialog.grab_set()
+        near_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(dialog, text='Incluir nombres parecidos ("ES: Antena 3 HD" y "Antena3")',
+                        variable=near_var).pack(anchor=tk.W, padx=5, pady=5)
+        summary = ttk.Label(dialog, text='')
+        summary.pack(anchor=tk.W, padx=5)
+        list_frame = ttk.Frame(dialog)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        groups_listbox = tk.Listbox(list_frame, width=70, height=15)
+        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=groups_listbox.yview)
+        groups_listbox.config(yscrollcommand=scrollbar.set)
+        groups_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        # Grupos encontrados: posiciones de self.view, el primero se conserva
+        groups = []
+
+        def search():
+            try:
+                dialog.config(cursor='watch')
+                dialog.update_idletasks()
+                channels = [self.view[i] for i in range(len(self.view))]
+                names = [extinf_name(extinf) for extinf, _ in channels]
+                urls = [channel_url(body) for _, body in channels]
+                groups[:] = find_duplicates(names, urls, near_var.get())
+            except Exception as e:
+                messagebox.showerror('Error', f'Error al buscar duplicados: {str(e)}', parent=dialog)
+                return
+            finally:
+                dialog.config(cursor='')
+            groups_listbox.delete(0, tk.END)
+            groups_listbox.insert(tk.END, *[f'{names[group[0]]} ({len(group)} canales)' for group in groups])
+            extra = sum(len(group) - 1 for group in groups)
+            summary.config(text=f'{len(groups)} grupos de duplicados, {extra} canales sobrantes')
+
+        def extra_positions():
+            return sorted(i for group in groups for i in group[1:])
+
+        def show_group(event=None):
+            selection = groups_listbox.curselection()
+            if not selection:
+                return
+            group = groups[selection[0]]
+            self.channels_listbox.selection_clear(0, tk.END)
+            for i in group:
+                self.channels_listbox.selection_set(i)
+            self.channels_listbox.see(group[0])
+
+        def select_extra():
+            self.channels_listbox.selection_clear(0, tk.END)
+            for i in extra_positions():
+                self.channels_listbox.selection_set(i)
+
+        def delete_extra():
+            positions = extra_positions()
+            if not positions:
+                return
+            if not messagebox.askyesno('Buscar duplicados',
+                                       f'¿Eliminar {len(positions)} canales sobrantes? '
+                                       'Se conserva el primero de cada grupo.', parent=dialog):
+                return
+            # Un solo borrado por lotes: se deshace de una vez con Ctrl+Z
+            self.view.delete(positions)
+            self.show_edit(range(0))
+            dialog.destroy()
+
+        groups_listbox.bind('<<ListboxSelect>>', show_group)
+        buttons = ttk.Frame(dialog)
+        buttons.pack(pady=10)
+        ttk.Button(buttons, text='Buscar', command=search).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text='Seleccionar sobrantes', command=select_extra).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text='Eliminar sobrantes', command=delete_extra).pack(side=tk.LEFT, padx=5)
+        search()
 
     def filter_channels(self, *args):
-        search_term = self.search_var.get().lower()
-        self.channels_listbox.delete(0, tk.END)
-        
-        for i, (extinf_line, _) in enumerate(self.channels):
-            channel_name = self.get_channel_name(extinf_line)
-            if search_term in channel_name.lower():
-                self.channels_listbox.insert(tk.END, channel_name)
\ No newline at end of file
+        # La lista filtrada sigue apuntando a los canales de self.channels:
+        # editar, cortar o borrar sus filas actúa sobre los canales correctos
+        self.view.filter(self.search_var.get().lower())
+        self.channels_listbox.set_items(self.view)
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""
+Buscar y reemplazar en un campo de los canales de una lista M3U: el grupo,
+el nombre visible, el logo, el servidor de la URL o sus parámetros. Lo usan
+M3USorter (sobre la lista abierta) y m3u_cli.py --reemplazar (sobre un
+archivo), así que no importa tkinter.
+"""
+import re
+import m3u_io
+from filter_expression import compile_filter
+from m3u_parser import extinf_field_span, extinf_name_span, read_entries
+
+# Campos en los que se puede reemplazar: clave y texto que se muestra
+TRANSFORM_FIELDS = (
+    ('group', 'Grupo (group-title)'),
+    ('name', 'Nombre'),
+    ('logo', 'Logo (tvg-logo)'),
+    ('host', 'Servidor de la URL'),
+    ('query', 'Parámetros de la URL'),
+)
+
+_ATTRIBUTES = {'group': 'group-title', 'logo': 'tvg-logo'}
+_URL_HOST_RE = re.compile(r'[A-Za-z][\w+.-]*://(?:[^/?#@\s]*@)?(\[[^\]\s]*\]|[^:/?#\s]*)')
+_URL_QUERY_RE = re.compile(r'\?([^#\s]*)')
+
+
+def _url_span(body):
+    """Posición (inicio, fin) en body de la URL: su última línea que no es un comentario"""
+    end = len(body)
+    while end > 0:
+        start = body.rfind('\n', 0, end - 1) + 1
+        line = body[start:end]
+        stripped = line.strip()
+        if stripped and not stripped.startswith('#'):
+            offset = line.find(stripped)
+            return start + offset, start + offset + len(stripped)
+        end = start
+    return None
+
+
+class Replacement:
+    """
+    Buscar find y poner replacement en el campo field (ver
+    TRANSFORM_FIELDS) de un canal (extinf, cuerpo). find es un texto literal
+    o, con regex=True, una expresión regular (replacement admite entonces
+    \\1, \\g<nombre>...). Solo se toca el valor del campo: el resto de la
+    línea queda igual, y los canales que no tienen el campo no cambian.
+    """
+
+    def __init__(self, field, find, replacement, regex=False, ignore_case=False):
+        if field not in dict(TRANSFORM_FIELDS):
+            raise ValueError(f"Campo no válido: {field}")
+        if not find:
+            raise ValueError("El texto a buscar está vacío")
+        self.field = field
+        flags = re.IGNORECASE if ignore_case else 0
+        try:
+            self.pattern = re.compile(find if regex else re.escape(find), flags)
+            if regex:
+                # Comprueba las referencias de replacement antes de empezar
+                self.pattern.sub(replacement, '')
+        except re.error as e:
+            raise ValueError(f"Expresión regular no válida: {e}")
+        self.replacement = replacement if regex else (lambda match: replacement)
+
+    def _span(self, extinf, body):
+        """(0 para extinf o 1 para el cuerpo, inicio, fin) del valor del campo, o None"""
+        field = self.field
+        if field in _ATTRIBUTES:
+            span = extinf_field_span(extinf, _ATTRIBUTES[field])
+            return None if span is None else (0,) + span
+        if field == 'name':
+            span = extinf_name_span(extinf)
+            return None if span is None else (0,) + span
+        url = _url_span(body)
+        if url is None:
+            return None
+        if field == 'host':
+            match = _URL_HOST_RE.match(body, url[0], url[1])
+        else:
+            match = _URL_QUERY_RE.search(body, url[0], url[1])
+        return None if match is None else (1,) + match.span(1)
+
+    def apply(self, channel):
+        """Canal con el campo reemplazado, o None si no cambia"""
+        span = self._span(*channel)
+        if span is None:
+            return None
+        part, start, end = span
+        text = channel[part]
+        value, count = self.pattern.subn(self.replacement, text[start:end])
+        if not count:
+            return None
+        # Un valor no puede partir la línea ni cerrar las comillas del atributo
+        value = value.replace('\n', ' ').replace('\r', ' ')
+        if self.field in _ATTRIBUTES:
+            value = value.replace('"', "'")
+        if value == text[start:end]:
+            return None
+        text = text[:start] + value + text[end:]
+        return (text, channel[1]) if part == 0 else (channel[0], text)
+
+
+def replace_channels(channels, replacements):
+    """
+    Aplica replacements (en orden) a cada canal de channels en una sola
+    pasada. Devuelve (posiciones, canales nuevos) de los que cambian, para
+    contarlos antes de aplicar o para sustituirlos todos de una vez.
+    """
+    positions = []
+    changed = []
+    for position, channel in enumerate(channels):
+        new = channel
+        for replacement in replacements:
+            new = replacement.apply(new) or new
+        if new is not channel:
+            positions.append(position)
+            changed.append(new)
+    return positions, changed
+
+
+def transform_m3u(input_path, output_path, replacements, pattern=None, mode='w', dedup=None):
+    """
+    Versión sin interfaz: copia la lista input_path (ruta, URL, comprimida o
+    no) a output_path aplicando replacements a cada entrada. Con pattern
+    solo se copian las entradas cuyo #EXTINF lo cumple, como en el filtro;
+    con un m3u_dedup.DedupIndex se omiten las repetidas (tras reemplazar).
+    Devuelve (entradas escritas, entradas cambiadas).
+    """
+    matches = compile_filter(pattern).matcher() if pattern else None
+    written = changed = 0
+    with m3u_io.open_output_text(output_path, mode) as outfile:
+        if mode == 'w':
+            outfile.write('#EXTM3U\n')
+        for entry in read_entries(input_path):
+            if matches is not None and not matches(entry.extinf):
+                continue
+            channel = new = (entry.extinf if entry.extinf.endswith('\n') else entry.extinf + '\n',
+                             ''.join(entry.lines[1:]))
+            for replacement in replacements:
+                new = replacement.apply(new) or new
+            url = _url_span(new[1])
+            if dedup is not None and not dedup.add(new[0].strip(), new[1][url[0]:url[1]] if url else ''):
+                continue
+            outfile.write(new[0])
+            outfile.write(new[1] if new[1].endswith('\n') else new[1] + '\n')
+            written += 1
+            changed += new is not channel
+    return written, changed
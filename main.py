@@ -4,6 +4,13 @@ from ttkthemes import ThemedStyle
 import os
 import subprocess
 import json
+import queue
+import threading
+from m3u_filter import ENGINES, filter_m3u_url
+from m3u_dedup import DedupIndex
+from m3u_cache import filter_m3u_cached
+import m3u_io
+from filter_expression import combine_patterns, compile_filter
 from video_player import VideoPlayer
 from about import show_about
 from keyboard import show_keyboard_shortcuts
@@ -35,6 +42,14 @@ class M3UProcessor:
         self.video_player = None
         self.tema_oscuro = False
         self.save_mode = tk.StringVar(value="w") 
+        self.engine = tk.StringVar(value="mmap")
+        self.dedup = tk.BooleanVar(value=False)
+        self.use_cache = tk.BooleanVar(value=False)
+        self.dedup_key = tk.StringVar(value="URL")
+        self.dedup_keys = {"URL": "url", "tvg-id": "tvg-id", "Nombre": "name"}
+        self.filter_queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.filter_thread = None
         
         # Configuración inicial
         self.create_menu()
@@ -58,7 +73,7 @@ class M3UProcessor:
         # Menú Procesar
         procesar_menu = tk.Menu(menubar, tearoff=0)
         procesar_menu.add_command(label="Establecer archivo de entrada M3U", command=self.browse_input)
-        procesar_menu.add_command(label="Cargar URL como archivo de entrada M3U", command=self.load_url)
+        procesar_menu.add_command(label="Cargar URL como archivo de entrada M3U", command=self.load_input_url)
         procesar_menu.add_command(label="Establecer archivo de salida", command=self.browse_output)
         procesar_menu.add_separator()
         procesar_menu.add_command(label="Procesar archivo", command=self.process_file)
@@ -95,7 +110,7 @@ class M3UProcessor:
         self.root.config(menu=menubar)
 
     def open_sorter(self):
-        filename = filedialog.askopenfilename(filetypes=[("Archivos M3U", "*.m3u")])
+        filename = filedialog.askopenfilename(filetypes=m3u_io.OPEN_FILETYPES)
         if filename:
             from m3u_sorter import M3USorter
             M3USorter(self.root, filename)
@@ -123,6 +138,20 @@ class M3UProcessor:
         ttk.Label(save_mode_frame, text="Modo de guardado:").pack(side=tk.LEFT)
         ttk.Radiobutton(save_mode_frame, text="Sobrescribir", variable=self.save_mode, value="w").pack(side=tk.LEFT, padx=5)
         ttk.Radiobutton(save_mode_frame, text="Añadir al final", variable=self.save_mode, value="a").pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(save_mode_frame, text="Evitar duplicados por", variable=self.dedup).pack(side=tk.LEFT, padx=(15, 5))
+        ttk.Combobox(save_mode_frame, textvariable=self.dedup_key, values=list(self.dedup_keys),
+                     state='readonly', width=8).pack(side=tk.LEFT)
+        
+        # Motor de filtrado
+        engine_frame = ttk.Frame(main_frame)
+        engine_frame.grid(row=3, column=1, sticky=tk.W, pady=(0, 5))
+        ttk.Label(engine_frame, text="Motor:").pack(side=tk.LEFT)
+        ttk.Radiobutton(engine_frame, text="Líneas", variable=self.engine, value="lineas").pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(engine_frame, text="Rápido (mmap)", variable=self.engine, value="mmap").pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(engine_frame, text=f"Paralelo ({os.cpu_count() or 1} núcleos)", variable=self.engine,
+                        value="paralelo").pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(engine_frame, text="Reutilizar resultados anteriores",
+                        variable=self.use_cache).pack(side=tk.LEFT, padx=(15, 5))
         
         # Patrón de búsqueda 
         pattern_frame = ttk.Frame(main_frame)
@@ -138,8 +167,8 @@ class M3UProcessor:
         buttons_frame = ttk.Frame(main_frame)
         buttons_frame.grid(row=6, column=0, columnspan=3, pady=10)
         
-        ttk.Button(buttons_frame, text='Procesar', command=self.process_file).pack(side=tk.LEFT, padx=5)
-        self.stop_processing = False
+        self.process_button = ttk.Button(buttons_frame, text='Procesar', command=self.process_file)
+        self.process_button.pack(side=tk.LEFT, padx=5)
         self.stop_button = ttk.Button(buttons_frame, text='Parar', command=self.stop_process, state='disabled')
         self.stop_button.pack(side=tk.LEFT, padx=5)
         self.open_folder_button = ttk.Button(buttons_frame, text='Abrir carpeta', command=self.open_output_folder, state='disabled')
@@ -153,7 +182,7 @@ class M3UProcessor:
     def edit_pattern(self):
         pattern_window = tk.Toplevel(self.root)
         pattern_window.title('Editar Patrón de Búsqueda')
-        pattern_window.geometry('400x300')
+        pattern_window.geometry('520x360')
         pattern_window.transient(self.root)
         pattern_window.grab_set()
 
@@ -170,30 +199,65 @@ class M3UProcessor:
             ttk.Button(buttons_container, text=pattern, command=lambda p=pattern: self.set_pattern(p, pattern_window)).pack(side=tk.LEFT, padx=2)
 
         ttk.Label(edit_frame, text='Patrón personalizado:').pack(fill=tk.X, pady=(10, 5))
-        custom_pattern = ttk.Entry(edit_frame, width=40)
+        custom_pattern = ttk.Entry(edit_frame, width=60)
         custom_pattern.insert(0, self.search_pattern.get())
         custom_pattern.pack(pady=5)
 
+        # Combinar patrones predefinidos en una sola expresión
+        combine_frame = ttk.Frame(edit_frame)
+        combine_frame.pack(fill=tk.X, pady=5)
+        ttk.Label(combine_frame, text='Añadir con OR:').pack(side=tk.LEFT)
+        for pattern in self.patterns_list:
+            ttk.Button(combine_frame, text=pattern,
+                       command=lambda p=pattern: self.append_pattern(custom_pattern, p)).pack(side=tk.LEFT, padx=2)
+
+        ttk.Label(edit_frame, justify=tk.LEFT, foreground='gray',
+                  text="Operadores: AND, OR, NOT o -término, paréntesis, 'literal con espacios'\n"
+                       "y re:expresión para expresiones regulares. Ejemplo:\n"
+                       "group-title=\"Deportes\" OR tvg-name=\"ES AND NOT XXX").pack(fill=tk.X, pady=5)
+
         buttons_frame = ttk.Frame(edit_frame)
         buttons_frame.pack(side=tk.BOTTOM, pady=10)
         ttk.Button(buttons_frame, text='Aplicar', command=lambda: self.apply_custom_pattern(custom_pattern.get(), pattern_window)).pack(side=tk.LEFT, padx=5)
         ttk.Button(buttons_frame, text='Cancelar', command=pattern_window.destroy).pack(side=tk.LEFT, padx=5)
     
+    def append_pattern(self, entry, pattern):
+        # Igual que m3u_cli con varios -p: el texto actual también se pone
+        # entre comillas o paréntesis si hace falta ("Canal+ (ES)")
+        try:
+            combined = combine_patterns([entry.get().strip(), pattern])
+        except ValueError as e:
+            messagebox.showerror("Error", str(e), parent=entry.winfo_toplevel())
+            return
+        entry.delete(0, tk.END)
+        entry.insert(0, combined)
+
     def set_pattern(self, pattern, window):
         self.search_pattern.set(pattern)
         window.destroy()
     
     def apply_custom_pattern(self, pattern, window):
+        if not self.validate_pattern(pattern, window):
+            return
         self.search_pattern.set(pattern)
         window.destroy()
 
+    def validate_pattern(self, pattern, parent=None):
+        """Comprueba que el patrón sea una expresión de filtrado válida"""
+        try:
+            compile_filter(pattern)
+            return True
+        except ValueError as e:
+            messagebox.showerror('Error', f'Patrón de búsqueda no válido: {e}', parent=parent or self.root)
+            return False
+
     def browse_input(self):
-        filename = filedialog.askopenfilename(filetypes=[("Archivos M3U", "*.m3u")])
+        filename = filedialog.askopenfilename(filetypes=m3u_io.OPEN_FILETYPES)
         if filename:
             self.input_file.set(filename)
     
     def browse_output(self):
-        filename = filedialog.asksaveasfilename(defaultextension=".m3u", filetypes=[("Archivos M3U", "*.m3u")])
+        filename = filedialog.asksaveasfilename(defaultextension=".m3u", filetypes=m3u_io.SAVE_FILETYPES)
         if filename:
             self.output_file.set(filename)
     
@@ -217,74 +281,104 @@ class M3UProcessor:
         if not self.output_file.get():
             messagebox.showerror('Error', 'Por favor, seleccione un archivo de salida')
             return
+        if self.filter_thread and self.filter_thread.is_alive():
+            return
+        if not self.validate_pattern(self.search_pattern.get()):
+            return
 
         mode = self.save_mode.get()  # Usar el valor del radiobutton
-        self.stop_processing = False
+        dedup_key = self.dedup_keys[self.dedup_key.get()] if self.dedup.get() else None
+        self.stop_event.clear()
         self.stop_button['state'] = 'normal'
+        self.process_button['state'] = 'disabled'
+        self.channels = []
+        self.progress['value'] = 0
+
+        # El filtrado se ejecuta en un hilo de fondo; la interfaz solo lee la cola
+        self.filter_thread = threading.Thread(
+            target=self._run_filter,
+            args=(self.input_file.get(), self.output_file.get(), self.search_pattern.get(), mode,
+                  self.engine.get(), dedup_key, self.use_cache.get()),
+            daemon=True
+        )
+        self.filter_thread.start()
+        self.root.after(100, self._poll_filter_queue)
+
+    def _run_filter(self, input_path, output_path, pattern, mode, engine, dedup_key=None, use_cache=False):
+        """Ejecuta el filtrado fuera del hilo de Tk y publica el resultado en la cola"""
         try:
-            self.channels = []
-            self.progress['value'] = 0
-            self.root.update()
-
-            file_size = os.path.getsize(self.input_file.get())
-            bytes_processed = 0
-            buffer = []
-            buffer_size = 2000  # Número de pares de líneas a acumular antes de escribir
-            update_interval = 2000  # Actualizar la barra de progreso cada N líneas
-            lines_since_update = 0
-
-            with open(self.input_file.get(), 'r', encoding='utf-8') as infile, \
-                 open(self.output_file.get(), mode, encoding='utf-8') as outfile:
-
-                if mode == 'w':
-                    outfile.write('#EXTM3U\n')
-
-                line1 = None
-                for line in infile:
-                    if self.stop_processing:
-                        break
-                    bytes_processed += len(line.encode('utf-8'))
-                    lines_since_update += 1
-
-                    if line.startswith('#EXTINF'):
-                        line1 = line
-                    elif line1 is not None:
-                        if self.search_pattern.get() in line1:
-                            buffer.append(line1)
-                            buffer.append(line)
-                            self.channels.append((line1.strip(), line.strip()))
-                        line1 = None
-
-                    # Escribir buffer y actualizar progreso cada cierto número de líneas
-                    if len(buffer) >= buffer_size * 2:
-                        outfile.writelines(buffer)
-                        buffer.clear()
-                    if lines_since_update >= update_interval:
-                        self.progress['value'] = (bytes_processed / file_size) * 100
-                        self.root.update()
-                        lines_since_update = 0
-
-                # Escribir lo que quede en el buffer antes de salir
-                if buffer:
-                    outfile.writelines(buffer)
-
-            self.last_output_folder = self.output_file.get()
-            self.open_folder_button['state'] = 'normal'
-            self.play_button['state'] = 'normal'
-            self.progress['value'] = 100
-            self.root.update()
-            if self.stop_processing:
-                messagebox.showinfo('Parado', 'El proceso de filtrado fue detenido por el usuario. El archivo contiene los datos filtrados hasta ese momento.')
+            # El índice de duplicados se carga aquí porque leer una salida
+            # grande puede tardar
+            dedup = DedupIndex.for_output(output_path, dedup_key, mode) if dedup_key else None
+            if m3u_io.is_url(input_path):
+                # Lista remota: se filtra mientras se descarga, sin guardarla
+                channels, stopped = filter_m3u_url(input_path, output_path, pattern, mode,
+                                                   progress_queue=self.filter_queue,
+                                                   stop_event=self.stop_event,
+                                                   dedup=dedup)
+            elif use_cache:
+                # Si la entrada no ha cambiado o solo ha crecido, no se vuelve a
+                # filtrar entera
+                channels, stopped = filter_m3u_cached(input_path, output_path, pattern, mode,
+                                                      progress_queue=self.filter_queue,
+                                                      stop_event=self.stop_event,
+                                                      dedup=dedup, engine=engine)
             else:
-                messagebox.showinfo('Éxito', 'Archivo procesado correctamente')
-
+                channels, stopped = ENGINES[engine](input_path, output_path, pattern, mode,
+                                                    progress_queue=self.filter_queue,
+                                                    stop_event=self.stop_event,
+                                                    dedup=dedup)
+            self.filter_queue.put(('fin', channels, stopped, dedup.skipped if dedup else 0))
         except Exception as e:
-            messagebox.showerror('Error', f'Error al procesar el archivo: {str(e)}')
-        finally:
-            self.stop_button['state'] = 'disabled'
+            self.filter_queue.put(('error', str(e)))
+
+    def _poll_filter_queue(self):
+        """Consume los mensajes del hilo de filtrado y actualiza la interfaz"""
+        try:
+            while True:
+                message = self.filter_queue.get_nowait()
+                if message[0] == 'progreso':
+                    self.progress['value'] = message[1]
+                elif message[0] == 'fin':
+                    self._filter_finished(message[1], message[2], message[3])
+                    return
+                elif message[0] == 'error':
+                    self.stop_button['state'] = 'disabled'
+                    self.process_button['state'] = 'normal'
+                    messagebox.showerror('Error', f'Error al procesar el archivo: {message[1]}')
+                    return
+        except queue.Empty:
+            pass
+        self.root.after(100, self._poll_filter_queue)
+
+    def _filter_finished(self, channels, stopped, skipped=0):
+        self.channels = channels
+        self.stop_button['state'] = 'disabled'
+        self.process_button['state'] = 'normal'
+        self.last_output_folder = self.output_file.get()
+        self.open_folder_button['state'] = 'normal'
+        self.play_button['state'] = 'normal'
+        self.progress['value'] = 100
+        if stopped:
+            messagebox.showinfo('Parado', 'El proceso de filtrado fue detenido por el usuario. El archivo contiene los datos filtrados hasta ese momento.')
+        else:
+            message = 'Archivo procesado correctamente'
+            if skipped:
+                message += f'\n{skipped} canales duplicados no se han añadido'
+            messagebox.showinfo('Éxito', message)
 
     def stop_process(self):
-        self.stop_processing = True
+        self.stop_event.set()
+
+    def load_input_url(self):
+        """Usa una lista remota como entrada del filtro; se leerá directamente de la red"""
+        url = tk.simpledialog.askstring("Cargar URL", "Introduce la URL de la lista M3U:", parent=self.root)
+        if url:
+            url = url.strip()
+            if not m3u_io.is_url(url):
+                messagebox.showerror('Error', 'La URL debe empezar por http://, https:// o ftp://')
+                return
+            self.input_file.set(url)
 
     def load_url(self):
         if not self.video_player:
@@ -302,7 +396,7 @@ class M3UProcessor:
         filename = filedialog.askopenfilename(
             parent=self.root,
             title="Selecciona un archivo M3U o M3U8",
-            filetypes=[("Archivos M3U/M3U8", "*.m3u *.m3u8"), ("Todos los archivos", "*")]
+            filetypes=m3u_io.OPEN_FILETYPES
         )
         if filename:
             self.video_player.load_m3u_file(filename)
@@ -330,8 +424,9 @@ class M3UProcessor:
         self.root.dnd_bind('<<Drop>>', self.handle_drop)
     
     def handle_drop(self, event):
-        file_path = event.data
-        if file_path.lower().endswith('.m3u'):
+        # Las rutas con espacios llegan entre llaves
+        file_path = event.data.strip().strip('{}')
+        if m3u_io.is_playlist_file(file_path):
             self.input_file.set(file_path)
     
     def load_config(self):
@@ -0,0 +1,85 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from m3u_filter import ENGINES, filter_m3u_parallel  # noqa: E402
+from m3u_index import M3UIndex  # noqa: E402
+
+
+def _write(path, text):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(text)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class EngineTestCase(unittest.TestCase):
+    """Los motores de m3u_filter deben escribir exactamente la misma salida"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def run_engines(self, text, pattern):
+        """Salida y canales de cada motor (el paralelo con bloques pequeños)"""
+        _write(self.path('in.m3u'), text)
+        results = {}
+        for name, engine in ENGINES.items():
+            output = self.path(f'{name}.m3u')
+            if engine is filter_m3u_parallel:
+                channels, stopped = engine(self.path('in.m3u'), output, pattern, workers=2, chunk_size=64)
+            else:
+                channels, stopped = engine(self.path('in.m3u'), output, pattern)
+            self.assertFalse(stopped)
+            results[name] = (_read(output), channels)
+        return results
+
+    def assert_same(self, results):
+        outputs = {name: output for name, (output, _) in results.items()}
+        self.assertEqual(len(set(outputs.values())), 1, outputs)
+        channels = {name: channels for name, (_, channels) in results.items()}
+        self.assertTrue(all(c == channels['lineas'] for c in channels.values()), channels)
+
+    def test_blocks_without_url_are_dropped(self):
+        text = ('#EXTM3U\n'
+                '#EXTINF:-1,Canal 1\nhttp://a/1\n'
+                '#EXTINF:-1,Canal 2\n#EXTVLCOPT:http-user-agent=x\n\n'
+                '#EXTINF:-1,Canal 3\n#EXTVLCOPT:http-referrer=y\nhttp://a/3\n'
+                '#EXTINF:-1,Canal 4\nhttp://a/4\n')
+        for pattern in ('Canal', 'Canal OR XXX', 'NOT XXX'):
+            results = self.run_engines(text, pattern)
+            self.assert_same(results)
+            output, channels = results['mmap']
+            self.assertNotIn(b'Canal 2', output)
+            self.assertEqual([url for _, url in channels], ['http://a/1', 'http://a/3', 'http://a/4'])
+
+    def test_regex_terms_match_like_line_engine(self):
+        text = '#EXTM3U\n' + ''.join(f'#EXTINF:-1 group-title="G{i % 3}",Canal {i}\nhttp://a/{i}\n'
+                                      for i in range(30))
+        for pattern in ('re:^#EXTINF:-1', "re:'Canal 1$'", 're:^#EXTINF OR XXX',
+                        "re:'Canal 2.$' AND group-title", 're:G1"'):
+            results = self.run_engines(text, pattern)
+            self.assert_same(results)
+            self.assertTrue(results['lineas'][1], pattern)
+
+    def test_index_skips_blocks_without_url(self):
+        _write(self.path('in.m3u'), '#EXTM3U\n#EXTINF:-1,A\n#EXTVLCOPT:x\n#EXTINF:-1,B\nhttp://b\n')
+        index = M3UIndex(self.path('in.m3u'))
+        try:
+            self.assertEqual(len(index), 1)
+            self.assertEqual(index.entry(0), ('#EXTINF:-1,B\n', 'http://b\n'))
+        finally:
+            index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,16 @@
 import os
 import psutil
 from favorites_manager import FavoritesManager
+from m3u_parser import extinf_field, extinf_name, normalize_lines, read_entries
+from channel_store import ChannelStore, ChannelView
+from virtual_list import VirtualListbox
+import m3u_io
+from m3u_cache import HttpCache, SnapshotCache, open_url_cached
 import vlc
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, simpledialog
 import json
+import queue
 import sys
 import requests
 import re
@@ -14,6 +20,17 @@ import traceback
 from youtube_player import YouTubeHandler
 from youtube_search import YouTubeSearchDialog
 
+# Carga progresiva de listas: el primer lote es pequeño para que la lista se
+# pueda usar enseguida; los siguientes se añaden en segundo plano
+LOAD_FIRST_BATCH = 200
+LOAD_BATCH = 5000
+# Cada cuánto se recogen los lotes leídos (ms) y cuántos como máximo cada vez,
+# para que la interfaz siga respondiendo con listas muy grandes
+LOAD_POLL_MS = 50
+LOAD_BATCHES_PER_POLL = 4
+# Espera tras la última pulsación en el buscador antes de buscar (ms)
+SEARCH_DELAY_MS = 120
+
 # Clase Tooltip para mostrar información al pasar el ratón
 class Tooltip:
     def __init__(self, widget):
@@ -58,7 +75,10 @@ class VideoPlayer:
             "--no-ts-trust-pcr"
         )
         self.player = self.instance.media_player_new()
-        self.channels = []
+        # Todos los canales cargados y la vista que se muestra en la lista
+        # (índices del almacén, o la lista de favoritos)
+        self.all_channels = ChannelStore()
+        self.channels = self.all_channels.view()
         self.current_channel = None
         self.channels_listbox = None
         self.channels_frame_visible = True
@@ -68,9 +88,10 @@ class VideoPlayer:
         self.empty_menu = None  # Menú vacío para ocultar en fullscreen
         self.volume = 50
         self.favorites = []
-        self.all_channels = []
         self.is_seeking = False 
         self.update_time_job = None  # Inicializar para evitar errores al cerrar
+        self.loading = None  # (stop_event, cola) de la carga de lista en curso
+        self.search_job = None  # Búsqueda pendiente del buscador
 
         # Inicializar el manejador de YouTube
         self.youtube_handler = YouTubeHandler(self)
@@ -116,14 +137,41 @@ class VideoPlayer:
         favorites_buttons_frame.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
         ttk.Button(favorites_buttons_frame, text="⭐ Favoritos", command=self.show_favorites).pack(side=tk.LEFT, padx=2)
         ttk.Button(favorites_buttons_frame, text="📺 Todos", command=self.restore_all_channels).pack(side=tk.LEFT, padx=2)
+        ttk.Button(favorites_buttons_frame, text="📂 Grupos", command=self.toggle_groups).pack(side=tk.LEFT, padx=2)
 
         # Búsqueda
         self.search_var = tk.StringVar()
         self.search_var.trace('w', self.filter_channels)
         self.search_entry = ttk.Entry(self.channels_frame, textvariable=self.search_var)
         self.search_entry.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
-
-        self.channels_listbox = tk.Listbox(self.channels_frame, width=30, yscrollcommand=None)
+        # Búsqueda aproximada: ordena por parecido y admite erratas
+        self.fuzzy_search = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.channels_frame, text="Búsqueda aproximada", variable=self.fuzzy_search,
+                        command=self.filter_channels).pack(side=tk.TOP, anchor=tk.W, padx=5)
+
+        # Grupos de la lista con su número de canales (oculto hasta pulsar
+        # "Grupos"); al elegir uno se muestran solo sus canales
+        self.groups_frame = ttk.Frame(self.channels_frame)
+        self.groups_tree = ttk.Treeview(self.groups_frame, columns=('count',), show='tree', height=8,
+                                        selectmode='browse')
+        self.groups_tree.column('#0', width=160, stretch=True)
+        self.groups_tree.column('count', width=60, anchor=tk.E, stretch=False)
+        groups_scrollbar = ttk.Scrollbar(self.groups_frame, orient="vertical", command=self.groups_tree.yview)
+        self.groups_tree.config(yscrollcommand=groups_scrollbar.set)
+        self.groups_tree.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        groups_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.groups_tree.bind('<<TreeviewSelect>>', self.show_selected_group)
+        self.group_names = []  # Grupo de cada fila del árbol
+
+        # Progreso de la carga de listas (se muestra solo mientras se carga)
+        self.loading_frame = ttk.Frame(self.channels_frame)
+        self.loading_label = ttk.Label(self.loading_frame, text="")
+        self.loading_label.pack(side=tk.LEFT, padx=5)
+        self.loading_cancel_button = ttk.Button(self.loading_frame, text="Cancelar", command=self.cancel_loading)
+        self.loading_cancel_button.pack(side=tk.RIGHT, padx=5)
+
+        # Lista virtual: solo se dibujan las filas visibles de self.channels
+        self.channels_listbox = VirtualListbox(self.channels_frame, label=lambda channel: channel[0], width=30)
         self.channels_listbox.pack(side=tk.LEFT, fill=tk.Y)
         self.channels_listbox.bind('<Double-Button-1>', self.play_selected)
         self.channels_listbox.bind('<Button-3>', self.show_channel_context_menu)
@@ -385,6 +433,11 @@ class VideoPlayer:
     def close(self):
         """Cierra la ventana y libera recursos."""
         try:
+            # Detener la carga de lista en curso, si la hay
+            if self.loading is not None:
+                self.loading[0].set()
+                self.loading = None
+
             # Desactivar los manejadores de eventos
             if hasattr(self, 'video_frame') and self.video_frame:
                 try:
@@ -502,20 +555,52 @@ class VideoPlayer:
         if not self.favorites:
             messagebox.showinfo("Favoritos", "Por el momento no hay favoritos añadidos.")
             return
-        self.temp_channels = self.channels.copy()
-        self.channels.clear()
-        self.channels_listbox.delete(0, tk.END)
-        
-        for channel in self.favorites:
-            self.channels.append(channel)
-            self.channels_listbox.insert(tk.END, channel[0])
+        self._show_channels([tuple(channel) for channel in self.favorites])
 
     
     def restore_all_channels(self):
-        self.channels = self.all_channels.copy()
-        self.channels_listbox.delete(0, tk.END)
-        for channel in self.channels:
-            self.channels_listbox.insert(tk.END, channel[0])
+        self._show_channels(self.all_channels.view())
+        self._refresh_groups()
+
+    def toggle_groups(self):
+        """Muestra u oculta el panel de grupos."""
+        if self.groups_frame.winfo_manager():
+            self.groups_frame.pack_forget()
+        else:
+            self.groups_frame.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5, before=self.channels_listbox)
+            self._refresh_groups()
+
+    def _refresh_groups(self):
+        """
+        Pone en el panel de grupos los del almacén (solo si está visible).
+        Los grupos que ya estaban solo cambian su número, así que durante la
+        carga no se pierde el grupo elegido.
+        """
+        if not self.groups_frame.winfo_manager():
+            return
+        tree = self.groups_tree
+        groups = self.all_channels.groups()
+        kept = 0
+        while kept < min(len(groups), len(self.group_names)) and groups[kept][0] == self.group_names[kept]:
+            tree.set(str(kept), 'count', groups[kept][1])
+            kept += 1
+        tree.delete(*[str(i) for i in range(kept, len(self.group_names))])
+        self.group_names = [group for group, _ in groups]
+        for i in range(kept, len(groups)):
+            group, count = groups[i]
+            tree.insert('', tk.END, iid=str(i), text=group or "Sin grupo", values=(count,))
+
+    def show_selected_group(self, event=None):
+        """Muestra en la lista los canales del grupo elegido en el panel."""
+        selection = self.groups_tree.selection()
+        if selection:
+            self._show_channels(self.all_channels.group_view(self.group_names[int(selection[0])]))
+
+    def _show_channels(self, channels):
+        """Muestra en la lista una vista del almacén o una lista de canales."""
+        self.channels = channels
+        # La lista lee los nombres de channels según se desplaza, sin copiarlos
+        self.channels_listbox.set_items(channels)
 
     def prompt_url(self):
         url = simpledialog.askstring("Cargar URL", "Introduce la URL de la lista M3U:")
@@ -525,63 +610,168 @@ class VideoPlayer:
     def prompt_file(self):
         filename = filedialog.askopenfilename(
             title="Selecciona un archivo M3U o M3U8",
-            filetypes=[("Archivos M3U/M3U8", "*.m3u *.m3u8"), ("Todos los archivos", "*")],
+            filetypes=m3u_io.OPEN_FILETYPES,
             parent=self.window
         )
         if filename:
             self.load_m3u_file(filename)
 
     def load_m3u_file(self, filename):
-        """Carga un archivo M3U local y procesa sus canales."""
-        try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                content = f.read()
-            self._process_m3u_content(content)
-            messagebox.showinfo("Éxito", f"Lista M3U cargada correctamente: {len(self.channels)} canales encontrados")
-        except Exception as e:
-            messagebox.showerror("Error", f"No se pudo cargar el archivo M3U: {e}")
+        """Carga un archivo M3U local (comprimido o no) en segundo plano."""
+        self._start_loading(filename, "No se pudo cargar el archivo M3U")
 
     def load_m3u_url(self, url):
-        """Carga una lista M3U desde una URL y procesa sus canales."""
-        try:
-            import urllib.request
-            with urllib.request.urlopen(url) as response:
-                content = response.read().decode('utf-8')
-            self._process_m3u_content(content)
-            messagebox.showinfo("Éxito", f"Lista M3U cargada correctamente: {len(self.channels)} canales encontrados")
-        except Exception as e:
-            messagebox.showerror("Error", f"No se pudo cargar la URL M3U: {e}")
+        """Carga una lista M3U desde una URL en segundo plano."""
+        self._start_loading(url, "No se pudo cargar la URL M3U")
 
-    def _process_m3u_content(self, content):
-        """Procesa el contenido de un archivo M3U y carga los canales."""
-        lines = content.strip().split('\n')
-        self.channels.clear()
+    def _start_loading(self, source, error_message):
+        """
+        Vacía la lista y empieza a leer source en un hilo. Los canales llegan
+        por lotes y se añaden a la lista según se leen, así que los primeros
+        se pueden reproducir mientras se carga el resto.
+        """
+        self.cancel_loading()
         self.all_channels.clear()
-        self.channels_listbox.delete(0, tk.END)
-        
-        i = 0
-        while i < len(lines):
-            if lines[i].startswith('#EXTINF:'):
-                if i + 1 < len(lines) and not lines[i + 1].startswith('#'):
-                    # Extraer nombre del canal de la línea EXTINF
-                    extinf_line = lines[i]
-                    url_line = lines[i + 1].strip()
-                    
-                    # Extraer el nombre del canal
-                    if ',' in extinf_line:
-                        name = extinf_line.split(',', 1)[1].strip()
-                    else:
-                        name = url_line
-                    
-                    # Añadir canal a las listas
-                    self.channels.append((name, url_line))
-                    self.all_channels.append((name, url_line))
-                    self.channels_listbox.insert(tk.END, name)
-                    i += 2
+        self.restore_all_channels()
+        stop_event = threading.Event()
+        messages = queue.Queue()
+        self.loading = (stop_event, messages)
+        threading.Thread(target=self._read_channels, args=(source, messages, stop_event), daemon=True).start()
+        self.loading_label.config(text="Cargando lista...")
+        self.loading_cancel_button.pack(side=tk.RIGHT, padx=5)
+        self.loading_frame.pack(side=tk.BOTTOM, fill=tk.X, before=self.channels_listbox)
+        self.window.after(LOAD_POLL_MS, self._check_loading, stop_event, messages, error_message)
+
+    def _read_channels(self, source, messages, stop_event):
+        """
+        Hilo de carga: si hay una copia procesada de la lista que sigue
+        valiendo (m3u_cache.SnapshotCache) envía el almacén entero; si no, lee
+        las entradas y las envía a la interfaz por lotes.
+        """
+        stream = entries = None
+        batch = []
+        batch_size = LOAD_FIRST_BATCH
+        count = 0
+        snapshots = SnapshotCache()
+        try:
+            path = source
+            if m3u_io.is_url(source):
+                # Las listas remotas pasan por la caché HTTP: si no han
+                # cambiado en el servidor se leen de la copia guardada
+                stream, _, path = open_url_cached(source)
+            fingerprint = None
+            if path is not None:
+                store, fingerprint = snapshots.load(path)
+                if store is not None:
+                    messages.put(('almacen', store))
+                    return
+            entries = read_entries(stream or source)
+            for entry in entries:
+                if stop_event.is_set():
+                    return
+                extinf_line, url_line = entry.text()
+                # Extraer el nombre del canal (respetando comas entre comillas)
+                name = extinf_name(extinf_line) or url_line
+                batch.append((name, url_line, extinf_field(extinf_line, 'group-title')))
+                if len(batch) >= batch_size:
+                    messages.put(('lote', self._index_batch(batch)))
+                    count += len(batch)
+                    batch = []
+                    batch_size = LOAD_BATCH
+            messages.put(('lote', self._index_batch(batch)))
+            count += len(batch)
+            entries.close()
+            if stream is not None:
+                # Al cerrarla se guarda la copia de la lista remota descargada
+                stream.close()
+                path = HttpCache().cached_path(source)
+                fingerprint = snapshots.fingerprint(path) if path else None
+            messages.put(('fin', (path, fingerprint, count) if fingerprint else None))
+        except Exception as e:
+            messages.put(('error', str(e)))
+        finally:
+            if entries is not None:
+                entries.close()
+            if stream is not None:
+                stream.close()
+
+    @staticmethod
+    def _index_batch(batch):
+        """Lote con los nombres ya normalizados para el índice de búsqueda del almacén."""
+        return batch, normalize_lines('\n'.join(name for name, _, _ in batch))
+
+    def _check_loading(self, stop_event, messages, error_message):
+        """Añade al almacén los lotes recibidos y actualiza el contador."""
+        if stop_event.is_set():
+            return
+        received = False
+        try:
+            for _ in range(LOAD_BATCHES_PER_POLL):
+                kind, data = messages.get_nowait()
+                if kind == 'lote':
+                    self.all_channels.extend(*data)
+                    received = True
+                    continue
+                self.loading = None
+                if kind == 'almacen':
+                    # Copia procesada de la lista: sustituye al almacén entero
+                    self.all_channels = data
+                    self.restore_all_channels()
+                    self._finish_loading(f"Lista cargada: {len(self.all_channels)} canales")
+                elif kind == 'fin':
+                    self.channels_listbox.refresh()
+                    self._refresh_groups()
+                    self._save_snapshot(data)
+                    self._finish_loading(f"Lista cargada: {len(self.all_channels)} canales")
                 else:
-                    i += 1
-            else:
-                i += 1
+                    self.channels_listbox.refresh()
+                    self._refresh_groups()
+                    self._finish_loading(f"Carga interrumpida: {len(self.all_channels)} canales")
+                    messagebox.showerror("Error", f"{error_message}: {data}")
+                return
+        except queue.Empty:
+            pass
+        if received:
+            self.channels_listbox.refresh()
+            self._refresh_groups()
+            self.loading_label.config(text=f"Cargando... {len(self.all_channels)} canales")
+        self.window.after(LOAD_POLL_MS, self._check_loading, stop_event, messages, error_message)
+
+    def _save_snapshot(self, data):
+        """Guarda la copia procesada de la lista recién leída para la próxima vez."""
+        if data is None:
+            return
+        path, fingerprint, count = data
+        # Si se han añadido o quitado canales durante la carga, ya no es la lista
+        if len(self.all_channels) != count:
+            return
+        try:
+            SnapshotCache().save(path, self.all_channels, fingerprint)
+        except OSError as e:
+            print(f"No se pudo guardar la copia procesada de la lista: {e}")
+
+    def _finish_loading(self, text):
+        """Deja el resultado de la carga unos segundos en el contador."""
+        self.loading_label.config(text=text)
+        self.loading_cancel_button.pack_forget()
+        # La búsqueda escrita durante la carga solo veía los canales de entonces
+        if self.search_var.get():
+            self.filter_channels()
+        self.window.after(4000, self._hide_loading)
+
+    def _hide_loading(self):
+        if self.loading is None:
+            self.loading_frame.pack_forget()
+
+    def cancel_loading(self):
+        """Detiene la carga de lista en curso; los canales ya leídos se quedan."""
+        if self.loading is None:
+            return
+        stop_event, _ = self.loading
+        stop_event.set()
+        self.loading = None
+        self.channels_listbox.refresh()
+        self._finish_loading(f"Carga cancelada: {len(self.all_channels)} canales")
 
     def prompt_youtube_playlist(self):
         """Solicita URL de playlist de YouTube y la carga."""
@@ -606,15 +796,13 @@ class VideoPlayer:
                     messagebox.showinfo("Info", "No se encontraron vídeos en la playlist.")
                     return
 
-                self.channels.clear()
-                self.channels_listbox.delete(0, tk.END)
+                self.cancel_loading()
                 self.all_channels.clear()
                 for video in videos:
                     title = video.get('title', 'Sin título')
                     video_url = f"https://www.youtube.com/watch?v={video.get('id')}"
-                    self.channels.append((title, video_url))
-                    self.all_channels.append((title, video_url))
-                    self.channels_listbox.insert(tk.END, title)
+                    self.all_channels.append(title, video_url)
+                self.restore_all_channels()
                 
                 messagebox.showinfo("Éxito", f"Playlist cargada: {len(videos)} vídeos")
         except Exception as e:
@@ -774,14 +962,17 @@ class VideoPlayer:
             self.player.audio_set_volume(self.volume)
 
     def filter_channels(self, *args):
-        search_term = self.search_var.get().lower()
-        self.channels.clear()
-        self.channels_listbox.delete(0, tk.END)
-        
-        for name, url in self.all_channels:
-            if search_term in name.lower():
-                self.channels.append((name, url))
-                self.channels_listbox.insert(tk.END, name)
+        """Busca al dejar de escribir, no en cada pulsación."""
+        if self.search_job is not None:
+            self.window.after_cancel(self.search_job)
+        self.search_job = self.window.after(SEARCH_DELAY_MS, self._apply_search)
+
+    def _apply_search(self):
+        self.search_job = None
+        if self.fuzzy_search.get():
+            self._show_channels(self.all_channels.fuzzy_search(self.search_var.get()))
+        else:
+            self._show_channels(self.all_channels.search(self.search_var.get()))
 
     def seek_relative(self, seconds):
         """Avanza o retrocede el video en segundos"""
@@ -803,9 +994,13 @@ class VideoPlayer:
 
     def add_channel_to_list(self, name, url):
         """Añade un canal o vídeo individual a la lista de la izquierda y a all_channels."""
-        self.channels.append((name, url))
-        self.all_channels.append((name, url))
-        self.channels_listbox.insert(tk.END, name)
+        if isinstance(self.channels, ChannelView):
+            self.channels.append(name, url)
+        else:
+            self.all_channels.append(name, url)
+            self.channels.append((name, url))
+        self.channels_listbox.refresh()
+        self._refresh_groups()
 
     def play_youtube_url(self, url):
         """Delega la reproducción de YouTube al manejador centralizado, forzando salida pulse y añade a la lista si no está."""
@@ -825,11 +1020,10 @@ class VideoPlayer:
 
     def cargar_videos_playlist(self, canales):
         """Carga los vídeos de una playlist de YouTube como canales en el listado."""
-        self.channels = canales
-        self.all_channels = canales.copy()
-        self.channels_listbox.delete(0, tk.END)
-        for nombre, url in canales:
-            self.channels_listbox.insert(tk.END, nombre)
+        self.cancel_loading()
+        self.all_channels.clear()
+        self.all_channels.extend(canales)
+        self.restore_all_channels()
 
     def download_channel(self, index):
         """Inicia la descarga del canal seleccionado en un hilo separado."""
@@ -909,12 +1103,10 @@ class VideoPlayer:
     def load_playlist_callback(self, channels_list):
          """Callback para cargar vídeos de una playlist en la lista principal."""
          if channels_list:
-             self.channels.clear()
-             self.channels_listbox.delete(0, tk.END)
-             self.all_channels = channels_list.copy() # Actualizar all_channels también
-             for name, url in channels_list:
-                 self.channels.append((name, url))
-                 self.channels_listbox.insert(tk.END, name)
+             self.cancel_loading()
+             self.all_channels.clear()
+             self.all_channels.extend(channels_list)
+             self.restore_all_channels()
              messagebox.showinfo("Playlist cargada", f"Se cargaron {len(channels_list)} vídeos de la playlist.")
 
     def toggle_play(self):
@@ -1186,18 +1378,23 @@ class VideoPlayer:
         """Elimina un canal específico de la lista."""
         try:
             if 0 <= index < len(self.channels):
-                del self.channels[index]
-                del self.all_channels[index]
-                self.channels_listbox.delete(index)
+                if isinstance(self.channels, ChannelView):
+                    # Se elimina del almacén el canal de esa fila, aunque la
+                    # vista esté filtrada
+                    self.channels.remove(index)
+                else:
+                    del self.channels[index]
+                self.channels_listbox.refresh()
+                self._refresh_groups()
         except Exception as e:
             print(f"Error al eliminar canal: {e}")
 
     def clear_channel_list(self):
         """Limpia toda la lista de canales."""
         try:
-            self.channels.clear()
+            self.cancel_loading()
             self.all_channels.clear()
-            self.channels_listbox.delete(0, tk.END)
+            self.restore_all_channels()
         except Exception as e:
             print(f"Error al limpiar la lista: {e}")
 
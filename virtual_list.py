@@ -0,0 +1,339 @@
+import tkinter as tk
+import tkinter.font as tkfont
+from tkinter import ttk
+
+
+class VirtualListbox(ttk.Frame):
+    """
+    Lista virtual con la interfaz de tk.Listbox que se usa en la aplicación
+    (curselection, selection_set, nearest, bbox, see, yview, bind...), pero
+    que solo crea en Tk las filas visibles. Los elementos salen de una
+    secuencia cualquiera (una lista, una ChannelView...) que no se copia,
+    así que cargar, filtrar o desplazarse cuesta lo mismo con cien canales
+    que con cien mil.
+
+    - set_items(secuencia) cambia lo que se muestra; label convierte cada
+      elemento en el texto de su fila (por defecto str).
+    - insert y delete modifican la secuencia como en un Listbox; solo se
+      admiten si es una lista. Si la secuencia es de otro tipo, el llamador
+      la modifica y llama a refresh().
+    - La selección se guarda como una máscara de bytes del tamaño de la
+      lista, de modo que seleccionar o borrar rangos grandes no recorre la
+      selección en Python.
+
+    Los bind se hacen sobre el Listbox interno, que es el que recibe los
+    eventos, igual que antes; la selección se notifica con <<ListboxSelect>>.
+    """
+
+    def __init__(self, master, items=None, label=None, selectmode=tk.BROWSE, **kwargs):
+        super().__init__(master)
+        self._items = items if items is not None else []
+        self._label = label or str
+        self._selectmode = selectmode
+        self._mask = bytearray(len(self._items))
+        self._top = 0
+        self._active = 0
+        self._anchor = None
+        self._row_height = None
+        self._render_job = None
+        self._yscrollcommand = kwargs.pop('yscrollcommand', None)
+
+        self.listbox = tk.Listbox(self, exportselection=False, selectmode=tk.MULTIPLE, **kwargs)
+        self.listbox.pack(fill=tk.BOTH, expand=True)
+
+        # Sin la clase Listbox en los bindtags: la selección la gestiona esta
+        # clase sobre la máscara y no el widget interno
+        tag = f'VirtualListbox{id(self)}'
+        self.listbox.bindtags((str(self.listbox), tag, str(self.listbox.winfo_toplevel()), 'all'))
+        for sequence, handler in (
+            ('<Configure>', lambda e: self._render()),
+            ('<Button-1>', self._on_click),
+            ('<Shift-Button-1>', lambda e: self._on_click(e, shift=True)),
+            ('<Control-Button-1>', lambda e: self._on_click(e, control=True)),
+            ('<B1-Motion>', self._on_motion),
+            ('<MouseWheel>', lambda e: self._scroll(-1 if e.delta > 0 else 1)),
+            ('<Button-4>', lambda e: self._scroll(-1)),
+            ('<Button-5>', lambda e: self._scroll(1)),
+            ('<Up>', lambda e: self._on_key(-1, e)),
+            ('<Down>', lambda e: self._on_key(1, e)),
+            ('<Prior>', lambda e: self._on_key(-self._rows(), e)),
+            ('<Next>', lambda e: self._on_key(self._rows(), e)),
+            ('<Home>', lambda e: self._on_key(-len(self._items), e)),
+            ('<End>', lambda e: self._on_key(len(self._items), e)),
+        ):
+            self.listbox.bind_class(tag, sequence, handler)
+
+    # --- Modelo ---
+
+    def set_items(self, items, label=None):
+        """Muestra otra secuencia de elementos y vacía la selección"""
+        self._items = items
+        if label is not None:
+            self._label = label
+        self._mask = bytearray(len(items))
+        self._top = 0
+        self._active = 0
+        self._anchor = None
+        self._render()
+
+    def refresh(self):
+        """
+        Vuelve a dibujar tras cambiar la secuencia desde fuera. Si solo ha
+        crecido (elementos añadidos al final) se conserva la selección; si ha
+        encogido, se vacía porque ya no se sabe a qué filas corresponde.
+        """
+        total = len(self._items)
+        if total > len(self._mask):
+            self._mask.extend(bytes(total - len(self._mask)))
+        elif total < len(self._mask):
+            self._mask = bytearray(total)
+        self._schedule_render()
+
+    def _index(self, index):
+        if index in (tk.END, 'end'):
+            return len(self._items)
+        if index == 'active':
+            return self._active
+        return int(index)
+
+    def _range(self, first, last=None):
+        first = self._index(first)
+        if last is None:
+            last = first
+        else:
+            last = min(self._index(last), len(self._items) - 1)
+        return first, last
+
+    def size(self):
+        return len(self._items)
+
+    def get(self, first, last=None):
+        if last is None:
+            return self._label(self._items[self._index(first)])
+        first, last = self._range(first, last)
+        return tuple(self._label(self._items[i]) for i in range(first, last + 1))
+
+    def insert(self, index, *elements):
+        index = self._index(index)
+        self._items[index:index] = elements
+        self._mask[index:index] = bytes(len(elements))
+        self._schedule_render()
+
+    def delete(self, first, last=None):
+        first, last = self._range(first, last)
+        if last < first:
+            return
+        del self._items[first:last + 1]
+        del self._mask[first:last + 1]
+        self._schedule_render()
+
+    # --- Selección ---
+
+    def curselection(self):
+        mask = self._mask
+        selection = []
+        i = mask.find(1)
+        while i >= 0:
+            selection.append(i)
+            i = mask.find(1, i + 1)
+        return tuple(selection)
+
+    def selection_set(self, first, last=None):
+        first, last = self._range(first, last)
+        if last >= first:
+            self._mask[first:last + 1] = b'\x01' * (last - first + 1)
+            self._schedule_render()
+
+    select_set = selection_set
+
+    def selection_clear(self, first, last=None):
+        first, last = self._range(first, last)
+        if last >= first:
+            self._mask[first:last + 1] = bytes(last - first + 1)
+            self._schedule_render()
+
+    select_clear = selection_clear
+
+    def selection_includes(self, index):
+        index = self._index(index)
+        return 0 <= index < len(self._mask) and bool(self._mask[index])
+
+    def activate(self, index):
+        self._active = max(0, min(self._index(index), len(self._items) - 1))
+        self._schedule_render()
+
+    # --- Geometría y desplazamiento ---
+
+    def _rows(self):
+        """Número de filas que caben en el widget"""
+        if self._row_height is None:
+            font = tkfont.Font(root=self.listbox, font=self.listbox.cget('font'))
+            self._row_height = font.metrics('linespace') + 2 * int(self.listbox.cget('selectborderwidth')) + 1
+        border = 2 * (int(self.listbox.cget('borderwidth')) + int(self.listbox.cget('highlightthickness')))
+        height = self.listbox.winfo_height() - border
+        if height <= 1:
+            # Aún no se ha mostrado: usar la altura configurada en filas
+            return int(self.listbox.cget('height')) or 10
+        return max(1, height // self._row_height)
+
+    def see(self, index):
+        index = self._index(index)
+        rows = self._rows()
+        if index < self._top:
+            self._top = index
+        elif index >= self._top + rows:
+            self._top = index - rows + 1
+        self._render()
+
+    def nearest(self, y):
+        if not self._items:
+            return -1
+        return min(self._top + max(0, self.listbox.nearest(y)), len(self._items) - 1)
+
+    def bbox(self, index):
+        index = self._index(index)
+        if self._top <= index < self._top + self.listbox.size():
+            return self.listbox.bbox(index - self._top)
+        return None
+
+    def yview(self, *args):
+        total = len(self._items)
+        rows = self._rows()
+        if not args:
+            if not total:
+                return 0.0, 1.0
+            return self._top / total, min(1.0, (self._top + rows) / total)
+        if args[0] == 'moveto':
+            self._top = int(float(args[1]) * total)
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            self._top += step * rows if args[2] == 'pages' else step
+        self._render()
+
+    def _scroll(self, units):
+        self.yview('scroll', units * 3, 'units')
+        return 'break'
+
+    # --- Configuración y eventos ---
+
+    def config(self, **kwargs):
+        if 'yscrollcommand' in kwargs:
+            self._yscrollcommand = kwargs.pop('yscrollcommand')
+            self._update_scrollbar()
+        if 'selectmode' in kwargs:
+            self._selectmode = kwargs.pop('selectmode')
+        if kwargs:
+            self.listbox.config(**kwargs)
+
+    configure = config
+
+    def cget(self, key):
+        if key == 'selectmode':
+            return self._selectmode
+        return self.listbox.cget(key)
+
+    def bind(self, sequence=None, func=None, add=None):
+        return self.listbox.bind(sequence, func, add)
+
+    def unbind(self, sequence, funcid=None):
+        self.listbox.unbind(sequence, funcid)
+
+    def focus_set(self):
+        self.listbox.focus_set()
+
+    def _notify(self):
+        self.listbox.event_generate('<<ListboxSelect>>')
+
+    def _on_click(self, event, shift=False, control=False):
+        index = self.nearest(event.y)
+        if index < 0:
+            return 'break'
+        self.listbox.focus_set()
+        extended = self._selectmode in (tk.EXTENDED, 'extended')
+        multiple = self._selectmode in (tk.MULTIPLE, 'multiple')
+        if extended and shift and self._anchor is not None:
+            self._mask = bytearray(len(self._items))
+            self._select_range(self._anchor, index)
+        elif (extended and control) or multiple:
+            self._mask[index] ^= 1
+            self._anchor = index
+        else:
+            self._mask = bytearray(len(self._items))
+            self._mask[index] = 1
+            self._anchor = index
+        self._active = index
+        self._render()
+        self._notify()
+        return 'break'
+
+    def _on_motion(self, event):
+        if self._selectmode in (tk.MULTIPLE, 'multiple', tk.SINGLE, 'single'):
+            return 'break'
+        index = self.nearest(event.y)
+        if index < 0 or index == self._active:
+            return 'break'
+        self._mask = bytearray(len(self._items))
+        if self._selectmode in (tk.EXTENDED, 'extended') and self._anchor is not None:
+            self._select_range(self._anchor, index)
+        else:
+            self._mask[index] = 1
+            self._anchor = index
+        self._active = index
+        self.see(index)
+        self._notify()
+        return 'break'
+
+    def _on_key(self, step, event):
+        if not self._items:
+            return 'break'
+        index = max(0, min(self._active + step, len(self._items) - 1))
+        shift = bool(event.state & 0x1)
+        self._mask = bytearray(len(self._items))
+        if shift and self._selectmode in (tk.EXTENDED, 'extended') and self._anchor is not None:
+            self._select_range(self._anchor, index)
+        else:
+            self._mask[index] = 1
+            self._anchor = index
+        self._active = index
+        self.see(index)
+        self._notify()
+        return 'break'
+
+    def _select_range(self, a, b):
+        first, last = min(a, b), max(a, b)
+        self._mask[first:last + 1] = b'\x01' * (last - first + 1)
+
+    # --- Dibujo ---
+
+    def _schedule_render(self):
+        # Varias modificaciones seguidas se dibujan una sola vez
+        if self._render_job is None:
+            self._render_job = self.after_idle(self._render)
+
+    def _render(self):
+        if self._render_job is not None:
+            self.after_cancel(self._render_job)
+            self._render_job = None
+        total = len(self._items)
+        rows = self._rows()
+        self._top = max(0, min(self._top, total - rows))
+        end = min(total, self._top + rows)
+        top = self._top
+        listbox = self.listbox
+        listbox.delete(0, tk.END)
+        if end > top:
+            label, items = self._label, self._items
+            listbox.insert(0, *[label(items[i]) for i in range(top, end)])
+            mask = self._mask
+            i = mask.find(1, top, end)
+            while i >= 0:
+                listbox.selection_set(i - top)
+                i = mask.find(1, i + 1, end)
+            if top <= self._active < end:
+                listbox.activate(self._active - top)
+        self._update_scrollbar()
+
+    def _update_scrollbar(self):
+        if self._yscrollcommand is not None:
+            first, last = self.yview()
+            self._yscrollcommand(first, last)